@@ -1,33 +1,113 @@
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from models import db, User, Book, BorrowRecord
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.middleware.proxy_fix import ProxyFix
+from models import db, User, Book, BorrowRecord, ArchivedBorrowRecord, BookRecommendation, Hold
+from config import Config, get_database_url
+from circulation_rollups import get_circulation_report, REPORT_GROUPS
+from login_guard import LoginThrottle, PasswordHashPool, HashPoolBusy
+from fragment_cache import FragmentCacheExtension, create_fragment_cache
+from response_pipeline import ResponsePipeline, cache_policy
+from cache_bus import (bump, CacheVersionTracker, VersionedCache, BOOKS, CATEGORIES, STATISTICS,
+                       DELETED_BOOKS)
+from notifications import notify_borrowed, notify_returned
+from sqlite_profile import apply_sqlite_profile, init_sqlite_profile, write_intent, write_transaction
+from tenancy import ENVIRON_KEY, Tenancy, current_tenant, load_tenants
+from availability_index import AvailabilityIndex, BookIdPagination
+from holds import (ACTIVE_STATUSES, allocate_copy, withdraw_hold, get_active_holds,
+                   queue_position, release_user_holds)
 from datetime import datetime, timedelta
 from functools import wraps
 import os
+import threading
 
 app = Flask(__name__)
 
 # Configuration - use environment variables for production
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-production')
 
-# Database configuration - support PostgreSQL for Render
-database_url = os.environ.get('DATABASE_URL')
-if database_url:
-    # Render uses postgres:// but SQLAlchemy needs postgresql://
-    # Also specify psycopg (v3) driver explicitly
-    if database_url.startswith('postgres://'):
-        database_url = database_url.replace('postgres://', 'postgresql+psycopg://', 1)
-    elif database_url.startswith('postgresql://'):
-        database_url = database_url.replace('postgresql://', 'postgresql+psycopg://', 1)
-    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
-else:
-    # Local development with SQLite
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///library.db'
+# Database configuration - DATABASE_URL (PostgreSQL on Render) or local SQLite
+app.config['SQLALCHEMY_DATABASE_URI'] = get_database_url()
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+def configure_branch_engine(engine):
+    """Branch databases on SQLite get the same profile as the main database"""
+    if Config.SQLITE_PROFILE and engine.dialect.name == 'sqlite':
+        apply_sqlite_profile(engine, Config.SQLITE_PRAGMAS)
+
+# Multi-branch mode: route each request to its branch's database.
+# Set up before db.init_app so its request hooks wrap the database session's
+if Config.TENANTS_FILE:
+    tenancy = Tenancy(
+        app, db, load_tenants(Config.TENANTS_FILE),
+        routing=Config.TENANT_ROUTING,
+        max_engines=Config.TENANT_MAX_ENGINES,
+        engine_options={'pool_size': Config.TENANT_POOL_SIZE,
+                        'max_overflow': Config.TENANT_MAX_OVERFLOW},
+        configure_engine=configure_branch_engine,
+        cli_tenant=Config.TENANT
+    )
+
 # Initialize database
 db.init_app(app)
 
+# SQLite profile for single-node deployments: WAL, busy timeout, BEGIN IMMEDIATE for writers
+sqlite_maintenance = None
+main_on_sqlite = app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+branches_on_sqlite = bool(Config.TENANTS_FILE) and any(
+    tenant['database_url'].startswith('sqlite') for tenant in tenancy.tenants.values()
+)
+
+def open_sqlite_branches():
+    """Branch engines get the profile from configure_branch_engine; this adds their maintenance"""
+    return [engine for engine in tenancy.registry.open_engines() if engine.dialect.name == 'sqlite']
+
+if Config.SQLITE_PROFILE and (main_on_sqlite or branches_on_sqlite):
+    with app.app_context():
+        sqlite_maintenance = init_sqlite_profile(
+            app, db.main_engine if main_on_sqlite else None,
+            Config.SQLITE_PRAGMAS, Config.SQLITE_MAINTENANCE_SECONDS,
+            extra_engines=open_sqlite_branches if branches_on_sqlite else None
+        )
+
+# Cache rendered catalog cards and record rows, keyed by each row's updated_at
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache = create_fragment_cache(Config.FRAGMENT_CACHE_BACKEND,
+                                                     Config.FRAGMENT_CACHE_MAX_BYTES,
+                                                     Config.FRAGMENT_CACHE_DIR)
+if Config.TENANTS_FILE:
+    # Row ids and updated_at stamps repeat across branch databases
+    app.jinja_env.fragment_cache_key_prefix = current_tenant
+
+# Load compiled templates instead of compiling them on each worker's first request
+# (fill the cache at build time with precompile_templates.py)
+if Config.JINJA_BYTECODE_CACHE_DIR:
+    os.makedirs(Config.JINJA_BYTECODE_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(Config.JINJA_BYTECODE_CACHE_DIR)
+
+# Compress responses, apply per-route Cache-Control and version static files
+ResponsePipeline(app, Config.COMPRESS_MIN_SIZE, Config.COMPRESS_LEVEL)
+
+# Behind a reverse proxy, take the client IP (used by the login throttle) from
+# X-Forwarded-For. Keep this the last wrapper of app.wsgi_app so it is outermost
+# and runs before TenantRouter or any other middleware reads the environ
+if Config.TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=Config.TRUSTED_PROXIES)
+
+# Per-worker caches, cleared when any worker bumps the matching cache_versions row
+cache_versions = CacheVersionTracker(Config.CACHE_VERSION_CHECK_INTERVAL, scope=current_tenant)
+category_cache = VersionedCache(cache_versions, CATEGORIES)
+statistics_cache = VersionedCache(cache_versions, STATISTICS)
+availability_index = AvailabilityIndex(cache_versions, Config.AVAILABILITY_INDEX_MAX_AGE,
+                                       Config.AVAILABILITY_INDEX_OVERLAP)
+
+# Login protection - throttle before hashing, and hash on a bounded pool
+login_ip_throttle = LoginThrottle(Config.LOGIN_IP_BURST, Config.LOGIN_IP_PER_MINUTE)
+login_user_throttle = LoginThrottle(Config.LOGIN_USER_BURST, Config.LOGIN_USER_PER_MINUTE)
+password_pool = PasswordHashPool(Config.LOGIN_HASH_WORKERS,
+                                 Config.LOGIN_HASH_QUEUE_LIMIT,
+                                 Config.LOGIN_HASH_TIMEOUT)
+
 # Login required decorator
 def login_required(f):
     @wraps(f)
@@ -53,24 +133,131 @@ def admin_required(f):
     return decorated_function
 
 # Initialize database with admin on first request
+_initialized_databases = set()
+_initialize_lock = threading.Lock()
+
 def init_db_with_admin():
-    """Initialize database and create admin if not exists"""
-    try:
-        db.create_all()
-        # Check if admin exists
-        admin = User.query.filter_by(username='admin').first()
-        if not admin:
-            admin = User(
-                username='admin',
-                full_name='System Administrator',
-                is_admin=True
-            )
-            admin.set_password('admin123')
-            db.session.add(admin)
-            db.session.commit()
-            print("Admin user created successfully")
-    except Exception as e:
-        print(f"Database initialization: {e}")
+    """Initialize database and create admin if not exists, once per worker and database"""
+    url = db.engine.url
+    if url in _initialized_databases:
+        return
+    
+    with _initialize_lock:
+        if url in _initialized_databases:
+            return
+        try:
+            db.create_all()
+            # Check if admin exists
+            admin = User.query.filter_by(username='admin').first()
+            if not admin:
+                admin = User(
+                    username='admin',
+                    full_name='System Administrator',
+                    is_admin=True
+                )
+                admin.set_password('admin123')
+                db.session.add(admin)
+                db.session.commit()
+                print("Admin user created successfully")
+            _initialized_databases.add(url)
+        except Exception as e:
+            print(f"Database initialization: {e}")
+
+def get_also_borrowed(book_ids, limit=3):
+    """Look up the precomputed "also borrowed" books for several books at once"""
+    if not book_ids:
+        return {}
+    
+    rows = db.session.query(
+        BookRecommendation.book_id,
+        BookRecommendation.score,
+        Book.id,
+        Book.title,
+        Book.author
+    ).join(Book, Book.id == BookRecommendation.recommended_book_id).filter(
+        BookRecommendation.book_id.in_(book_ids),
+        BookRecommendation.rank < limit
+    ).order_by(BookRecommendation.book_id, BookRecommendation.rank)
+    
+    also_borrowed = {}
+    for book_id, score, other_id, title, author in rows:
+        also_borrowed.setdefault(book_id, []).append({
+            'id': other_id,
+            'title': title,
+            'author': author,
+            'score': score
+        })
+    return also_borrowed
+
+
+def get_categories():
+    """Distinct book categories, cached per worker"""
+    return category_cache.get_or_set('all', lambda: [
+        category for (category,) in db.session.query(Book.category).distinct().order_by(Book.category)
+        if category
+    ])
+
+
+def _count_statistics():
+    status_counts = dict(db.session.query(BorrowRecord.status, db.func.count(BorrowRecord.id)).filter(
+        BorrowRecord.status.in_(['borrowed', 'overdue'])
+    ).group_by(BorrowRecord.status).all())
+    
+    return {
+        'total_books': Book.query.count(),
+        'total_users': User.query.filter_by(is_admin=False).count(),
+        'active_borrows': sum(status_counts.values()),
+        'overdue_books': status_counts.get('overdue', 0)
+    }
+
+
+def get_library_statistics():
+    """Library-wide counts for the admin dashboard and /api/statistics, cached per worker"""
+    return statistics_cache.get_or_set('counts', _count_statistics)
+
+
+@app.before_request
+def ensure_database():
+    init_db_with_admin()
+
+
+@app.before_request
+def check_cache_versions():
+    cache_versions.refresh()
+
+
+def warm_up():
+    """Fill this process's caches, e.g. in the gunicorn master before it forks workers.
+
+    Serves the catalog and the admin dashboard of every branch as its admin
+    through the test client. That loads the templates and fills the category,
+    statistics, book-card and static-version caches, which the workers then
+    share copy-on-write.
+    """
+    branches = list(tenancy.tenants)[:Config.TENANT_MAX_ENGINES] if Config.TENANTS_FILE else [None]
+    client = app.test_client()
+    
+    for branch in branches:
+        with tenancy.branch(branch) if branch else app.app_context():
+            init_db_with_admin()
+            admin = User.query.filter_by(is_admin=True).order_by(User.id).first()
+        if admin is None:
+            continue
+        
+        with client.session_transaction() as warm_session:
+            warm_session.update(user_id=admin.id, username=admin.username, is_admin=True, tenant=branch)
+        environ = {ENVIRON_KEY: branch} if branch else {}
+        for path in ('/books', '/admin'):
+            client.get(path, environ_overrides=environ)
+    
+    # Workers must open their own connections and maintenance threads
+    if sqlite_maintenance is not None:
+        sqlite_maintenance.stop()
+    with app.app_context():
+        db.main_engine.dispose()
+    if Config.TENANTS_FILE:
+        tenancy.registry.dispose_all()
+
 
 # Context processor to make current user available in all templates
 @app.context_processor
@@ -85,11 +272,8 @@ def inject_user():
 
 @app.route('/')
 @app.route('/login', methods=['GET', 'POST'])
+@write_intent(False)  # Hash outside the write lock; the rehash uses write_transaction()
 def login():
-    # Initialize database on first access
-    with app.app_context():
-        init_db_with_admin()
-    
     if 'user_id' in session:
         user = User.query.get(session['user_id'])
         if user and user.is_admin:
@@ -100,9 +284,35 @@ def login():
         username = request.form.get('user')
         password = request.form.get('pass')
         
+        # Refuse hopeless attempts before spending any CPU on a hash
+        # The same username can exist at several branches
+        user_key = (current_tenant(), (username or '').lower())
+        if not login_ip_throttle.allow(request.remote_addr) or \
+                not login_user_throttle.allow(user_key):
+            flash('Too many login attempts. Please wait a minute and try again.', 'danger')
+            return render_template('librarylogin.html'), 429, {'Retry-After': '60'}
+        
         user = User.query.filter_by(username=username).first()
         
-        if user and user.check_password(password):
+        try:
+            password_ok = user is not None and password_pool.verify(user.password_hash, password or '')
+        except HashPoolBusy:
+            flash('The server is busy. Please try again in a few seconds.', 'warning')
+            return render_template('librarylogin.html'), 429, {'Retry-After': '5'}
+        
+        if password_ok:
+            # Upgrade the stored hash when the hashing parameters have changed
+            if user.needs_rehash():
+                try:
+                    password_hash = password_pool.hash(password, Config.PASSWORD_HASH_METHOD)
+                except HashPoolBusy:
+                    password_hash = None  # Upgrade it on a later login instead of failing this one
+                if password_hash:
+                    with write_transaction(db.session):
+                        user.password_hash = password_hash
+                        db.session.commit()
+            login_user_throttle.reset(user_key)
+            
             session['user_id'] = user.id
             session['username'] = user.username
             session['is_admin'] = user.is_admin
@@ -119,6 +329,7 @@ def login():
 
 
 @app.route('/signup', methods=['GET', 'POST'])
+@write_intent(False)  # Hash outside the write lock; the insert uses write_transaction()
 def signup():
     if 'user_id' in session:
         user = User.query.get(session['user_id'])
@@ -131,6 +342,7 @@ def signup():
         password = request.form.get('password')
         confirm_password = request.form.get('confirm_password')
         full_name = request.form.get('full_name')
+        email = (request.form.get('email') or '').strip() or None
         
         # Validation
         if not username or not password or not full_name:
@@ -149,22 +361,34 @@ def signup():
             flash('Passwords do not match.', 'danger')
             return render_template('signup.html')
         
-        # Check if username already exists
-        existing_user = User.query.filter_by(username=username).first()
-        if existing_user:
-            flash('Username already exists. Please choose a different one.', 'danger')
+        if email and '@' not in email:
+            flash('Please enter a valid email address.', 'danger')
             return render_template('signup.html')
         
-        # Create new user
-        new_user = User(
-            username=username,
-            full_name=full_name,
-            is_admin=False
-        )
-        new_user.set_password(password)
+        # Hash before taking the write lock; the insert below is tiny
+        try:
+            password_hash = password_pool.hash(password, Config.PASSWORD_HASH_METHOD)
+        except HashPoolBusy:
+            flash('The server is busy. Please try again in a few seconds.', 'warning')
+            return render_template('signup.html'), 429, {'Retry-After': '5'}
         
-        db.session.add(new_user)
-        db.session.commit()
+        # Check the username and create the user in one write transaction
+        with write_transaction(db.session):
+            username_taken = User.query.filter_by(username=username).first() is not None
+            if not username_taken:
+                db.session.add(User(
+                    username=username,
+                    full_name=full_name,
+                    email=email,
+                    is_admin=False,
+                    password_hash=password_hash
+                ))
+                bump(STATISTICS)
+            db.session.commit()
+        
+        if username_taken:
+            flash('Username already exists. Please choose a different one.', 'danger')
+            return render_template('signup.html')
         
         flash('Account created successfully! Please log in.', 'success')
         return redirect(url_for('login'))
@@ -217,6 +441,7 @@ def dashboard():
         user_id=user.id, 
         status='returned'
     ).count()
+    books_returned += ArchivedBorrowRecord.query.filter_by(user_id=user.id).count()
     
     return render_template('dashboard.html', 
                          current_month_fine=current_month_fine,
@@ -228,6 +453,7 @@ def dashboard():
 
 @app.route('/search')
 @login_required
+@cache_policy('private, no-cache', etag=True)
 def search():
     query = request.args.get('q', '')
     category = request.args.get('category', 'all')
@@ -248,36 +474,49 @@ def search():
         book_query = book_query.filter_by(category=category)
     
     books = book_query.all()
+    also_borrowed = get_also_borrowed([book.id for book in books])
     
-    return render_template('borrowbooks.html', books=books, search_query=query)
+    return render_template('borrowbooks.html', books=books, search_query=query,
+                         also_borrowed=also_borrowed)
 
 
 @app.route('/books')
 @login_required
+@cache_policy('private, no-cache', etag=True)
 def show_books():
     """Show all available books"""
     query = request.args.get('q', '')
     category = request.args.get('category', '')
-    
-    book_query = Book.query
+    available_only = request.args.get('available') == '1'
+    page = request.args.get('page', 1, type=int)
     
     if query:
-        book_query = book_query.filter(
+        # Text search needs the database
+        book_query = Book.query.filter(
             db.or_(
                 Book.title.ilike(f'%{query}%'),
                 Book.author.ilike(f'%{query}%'),
                 Book.isbn.ilike(f'%{query}%')
             )
         )
+        if category:
+            book_query = book_query.filter_by(category=category)
+        if available_only:
+            book_query = book_query.filter(Book.available_copies > 0)
+        pagination = book_query.order_by(Book.id).paginate(
+            page=page, per_page=Config.BOOKS_PER_PAGE, error_out=False)
+    else:
+        # Category and availability filters come from the in-memory index;
+        # only the books on this page are loaded
+        pagination = BookIdPagination(ids=availability_index.book_ids(category, available_only),
+                                      page=page, per_page=Config.BOOKS_PER_PAGE, error_out=False)
     
-    if category:
-        book_query = book_query.filter_by(category=category)
-    
-    books = book_query.all()
-    categories = db.session.query(Book.category).distinct().all()
-    categories = [cat[0] for cat in categories if cat[0]]
+    books = pagination.items
+    categories = get_categories()
+    also_borrowed = get_also_borrowed([book.id for book in books])
     
-    return render_template('borrowbooks.html', books=books, categories=categories)
+    return render_template('borrowbooks.html', books=books, categories=categories,
+                         also_borrowed=also_borrowed, pagination=pagination)
 
 
 @app.route('/borrow/<int:book_id>', methods=['POST'])
@@ -286,10 +525,13 @@ def borrow_book(book_id):
     """Borrow a book"""
     book = Book.query.get_or_404(book_id)
     user = User.query.get(session['user_id'])
+    hold = get_active_holds(user.id, [book_id]).get(book_id)
+    # A ready hold means a copy was already set aside for this user
+    set_aside = hold is not None and hold.status == 'ready'
     
     # Check if book is available
-    if not book.is_available():
-        flash('This book is not available for borrowing.', 'warning')
+    if not set_aside and not book.is_available():
+        flash('This book is not available for borrowing. Place a hold to be next in line.', 'warning')
         return redirect(url_for('show_books'))
     
     # Check if user already has this book
@@ -312,10 +554,15 @@ def borrow_book(book_id):
         status='borrowed'
     )
     
-    # Decrease available copies
-    book.borrow()
+    if not set_aside:
+        # Decrease available copies
+        book.borrow()
+    if hold is not None:
+        hold.status = 'fulfilled'
     
     db.session.add(borrow_record)
+    notify_borrowed(user.id, book, borrow_record.due_date)
+    bump(BOOKS, STATISTICS)
     db.session.commit()
     
     flash(f'Successfully borrowed "{book.title}". Due date: {borrow_record.due_date.strftime("%Y-%m-%d")}', 'success')
@@ -324,10 +571,21 @@ def borrow_book(book_id):
 
 @app.route('/my-books')
 @login_required
+@write_intent()  # Commits overdue status changes
 def my_books():
     """Show user's borrowed books"""
     user = User.query.get(session['user_id'])
     
+    # Archived history is only read when asked for, one page at a time
+    if request.args.get('history') == 'archived':
+        pagination = ArchivedBorrowRecord.query.filter_by(user_id=user.id).order_by(
+            ArchivedBorrowRecord.borrow_date.desc()
+        ).paginate(page=request.args.get('page', 1, type=int),
+                   per_page=Config.RECORDS_PER_PAGE, error_out=False)
+        
+        return render_template('borrowrecord.html', records=pagination.items,
+                               pagination=pagination, is_user_view=True, is_archive_view=True)
+    
     # Update status for overdue books
     active_records = BorrowRecord.query.filter_by(
         user_id=user.id,
@@ -339,14 +597,89 @@ def my_books():
             record.status = 'overdue'
             record.calculate_fine()
     
+    if any(record.status == 'overdue' for record in active_records):
+        bump(STATISTICS)
     db.session.commit()
     
     # Get all user's borrow records
-    borrow_records = BorrowRecord.query.filter_by(user_id=user.id).order_by(
+    borrow_records = BorrowRecord.query.filter_by(user_id=user.id).options(
+        db.joinedload(BorrowRecord.book)
+    ).order_by(
         BorrowRecord.borrow_date.desc()
     ).all()
     
-    return render_template('borrowrecord.html', records=borrow_records, is_user_view=True)
+    holds = Hold.query.filter(
+        Hold.user_id == user.id,
+        Hold.status.in_(ACTIVE_STATUSES)
+    ).options(db.joinedload(Hold.book)).order_by(Hold.created_at).all()
+    queue_positions = {
+        hold.id: queue_position(hold) for hold in holds if hold.status == 'waiting'
+    }
+    
+    return render_template('borrowrecord.html', records=borrow_records, is_user_view=True,
+                         holds=holds, queue_positions=queue_positions)
+
+
+@app.route('/holds/<int:book_id>', methods=['POST'])
+@login_required
+def place_hold(book_id):
+    """Join the queue for a book with no copies on the shelf"""
+    book = Book.query.get_or_404(book_id)
+    user = User.query.get(session['user_id'])
+    
+    if book.is_available():
+        flash('This book is available now, so you can borrow it straight away.', 'info')
+        return redirect(url_for('show_books'))
+    
+    active_holds = Hold.query.filter(
+        Hold.user_id == user.id,
+        Hold.status.in_(ACTIVE_STATUSES)
+    ).all()
+    
+    if any(hold.book_id == book_id for hold in active_holds):
+        flash('You already have a hold on this book.', 'warning')
+        return redirect(url_for('my_books'))
+    
+    if len(active_holds) >= Config.MAX_HOLDS_PER_USER:
+        flash(f'You can have at most {Config.MAX_HOLDS_PER_USER} holds at a time.', 'warning')
+        return redirect(url_for('my_books'))
+    
+    already_borrowed = BorrowRecord.query.filter(
+        BorrowRecord.user_id == user.id,
+        BorrowRecord.book_id == book_id,
+        BorrowRecord.status.in_(['borrowed', 'overdue'])
+    ).first()
+    if already_borrowed:
+        flash('You have already borrowed this book.', 'warning')
+        return redirect(url_for('show_books'))
+    
+    hold = Hold(user_id=user.id, book_id=book_id)
+    db.session.add(hold)
+    db.session.commit()
+    
+    flash(f'Hold placed on "{book.title}". You are number {queue_position(hold)} in the queue.', 'success')
+    return redirect(url_for('my_books'))
+
+
+@app.route('/holds/<int:hold_id>/cancel', methods=['POST'])
+@login_required
+def cancel_hold(hold_id):
+    """Leave the queue; a copy already set aside passes to the next patron"""
+    hold = Hold.query.get_or_404(hold_id)
+    
+    if hold.user_id != session['user_id']:
+        flash('You can only cancel your own holds.', 'danger')
+        return redirect(url_for('my_books'))
+    
+    if hold.status not in ACTIVE_STATUSES:
+        flash('This hold is no longer active.', 'info')
+        return redirect(url_for('my_books'))
+    
+    withdraw_hold(hold, 'cancelled')
+    db.session.commit()
+    
+    flash(f'Hold on "{hold.book.title}" cancelled.', 'success')
+    return redirect(url_for('my_books'))
 
 
 # ==================== Admin Routes ====================
@@ -355,21 +688,13 @@ def my_books():
 @admin_required
 def admin_dashboard():
     """Admin dashboard with statistics"""
-    total_books = Book.query.count()
-    total_users = User.query.filter_by(is_admin=False).count()
-    
-    # Overdue books
-    overdue_count = BorrowRecord.query.filter_by(status='overdue').count()
-    
-    # Active borrows
-    active_borrows = BorrowRecord.query.filter_by(status='borrowed').count()
-    active_borrows += BorrowRecord.query.filter_by(status='overdue').count()
+    statistics = get_library_statistics()
     
     return render_template('Admindashbord.html',
-                         total_books=total_books,
-                         total_users=total_users,
-                         overdue_count=overdue_count,
-                         active_borrows=active_borrows)
+                         total_books=statistics['total_books'],
+                         total_users=statistics['total_users'],
+                         overdue_count=statistics['overdue_books'],
+                         active_borrows=statistics['active_borrows'])
 
 
 @app.route('/admin/books')
@@ -414,6 +739,7 @@ def add_book():
         )
         
         db.session.add(book)
+        bump(BOOKS, CATEGORIES, STATISTICS)
         db.session.commit()
         
         flash(f'Book "{title}" added successfully!', 'success')
@@ -439,12 +765,19 @@ def edit_book(book_id):
         book.description = request.form.get('description')
         
         new_total = request.form.get('total_copies', type=int)
-        if new_total:
+        if new_total and new_total > book.total_copies:
+            # New copies go to waiting holds first, in queue order; the rest are shelved
+            added = new_total - book.total_copies
+            book.total_copies = new_total
+            for _ in range(added):
+                allocate_copy(book)
+        elif new_total:
             # Adjust available copies proportionally
             borrowed = book.total_copies - book.available_copies
             book.total_copies = new_total
             book.available_copies = max(0, new_total - borrowed)
         
+        bump(BOOKS, CATEGORIES)
         db.session.commit()
         
         flash(f'Book "{book.title}" updated successfully!', 'success')
@@ -460,33 +793,89 @@ def delete_book(book_id):
     book = Book.query.get_or_404(book_id)
     
     # Check if book has active borrows
-    active_borrows = BorrowRecord.query.filter_by(
-        book_id=book_id,
-        status='borrowed'
-    ).count()
-    
-    active_borrows += BorrowRecord.query.filter_by(
-        book_id=book_id,
-        status='overdue'
+    active_borrows = BorrowRecord.query.filter(
+        BorrowRecord.book_id == book_id,
+        BorrowRecord.status.in_(['borrowed', 'overdue'])
     ).count()
     
     if active_borrows > 0:
         flash('Cannot delete book with active borrows.', 'danger')
         return redirect(url_for('manage_books'))
     
+    # Borrow history is removed by the database's ON DELETE CASCADE
     db.session.delete(book)
+    bump(BOOKS, CATEGORIES, STATISTICS, DELETED_BOOKS)
     db.session.commit()
     
     flash(f'Book "{book.title}" deleted successfully.', 'success')
     return redirect(url_for('manage_books'))
 
 
+def _chunks(ids, size=None):
+    """Split ids into lists small enough for one IN (...) clause"""
+    size = size or Config.BULK_CHUNK_SIZE
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _bulk_delete(model, ids, borrow_column, cache_names, *criteria, before_delete=None):
+    """Delete rows by id with a few set-based statements.
+    
+    Rows that do not match criteria or still have active borrows are skipped.
+    Their borrow history goes with them through ON DELETE CASCADE.
+    before_delete, if given, is called with the ids about to be deleted.
+    """
+    existing = set()
+    busy = set()
+    for chunk in _chunks(ids):
+        existing.update(row_id for (row_id,) in db.session.query(model.id).filter(
+            model.id.in_(chunk), *criteria
+        ))
+        busy.update(row_id for (row_id,) in db.session.query(borrow_column).filter(
+            borrow_column.in_(chunk),
+            BorrowRecord.status.in_(['borrowed', 'overdue'])
+        ).distinct())
+    
+    deletable = [row_id for row_id in ids if row_id in existing and row_id not in busy]
+    if deletable and before_delete is not None:
+        before_delete(deletable)
+    for chunk in _chunks(deletable):
+        db.session.execute(db.delete(model).where(model.id.in_(chunk)))
+    if deletable:
+        bump(*cache_names)
+    db.session.commit()
+    
+    results = []
+    for row_id in ids:
+        if row_id not in existing:
+            results.append({'id': row_id, 'ok': False, 'message': 'Not found.'})
+        elif row_id in busy:
+            results.append({'id': row_id, 'ok': False, 'message': 'Cannot delete while books are on loan.'})
+        else:
+            results.append({'id': row_id, 'ok': True})
+    return results
+
+
+@app.route('/admin/books/bulk-delete', methods=['POST'])
+@admin_required
+def bulk_delete_books():
+    """Delete many books at once, e.g. when weeding the collection"""
+    results = _bulk_delete(Book, _get_id_list('book_ids'), BorrowRecord.book_id,
+                           (BOOKS, CATEGORIES, STATISTICS, DELETED_BOOKS))
+    return _batch_response(results, 'manage_books')
+
+
 @app.route('/admin/users')
 @admin_required
 def manage_users():
     """Manage all users"""
     users = User.query.filter_by(is_admin=False).order_by(User.created_at.desc()).all()
     
+    archived_fines = dict(
+        db.session.query(ArchivedBorrowRecord.user_id, db.func.sum(ArchivedBorrowRecord.fine_amount))
+        .group_by(ArchivedBorrowRecord.user_id)
+    )
+    
     # Calculate statistics for each user
     user_stats = []
     for user in users:
@@ -499,6 +888,7 @@ def manage_users():
             record.calculate_fine() 
             for record in BorrowRecord.query.filter_by(user_id=user.id).all()
         )
+        total_fine += archived_fines.get(user.id) or 0
         
         user_stats.append({
             'user': user,
@@ -509,12 +899,32 @@ def manage_users():
     return render_template('Manageuser.html', user_stats=user_stats)
 
 
+@app.route('/admin/users/bulk-delete', methods=['POST'])
+@admin_required
+def bulk_delete_users():
+    """Delete many user accounts at once; admin accounts are never deleted"""
+    results = _bulk_delete(User, _get_id_list('user_ids'), BorrowRecord.user_id,
+                           (STATISTICS,), User.is_admin == False,
+                           before_delete=release_user_holds)
+    return _batch_response(results, 'manage_users')
+
+
 @app.route('/admin/borrow-records')
 @admin_required
+@write_intent()  # Commits refreshed fines
 def borrow_records():
     """View all borrow records"""
     status_filter = request.args.get('status', 'all')
     
+    if status_filter == 'archived':
+        pagination = ArchivedBorrowRecord.query.order_by(
+            ArchivedBorrowRecord.borrow_date.desc()
+        ).paginate(page=request.args.get('page', 1, type=int),
+                   per_page=Config.RECORDS_PER_PAGE, error_out=False)
+        
+        return render_template('borrowrecord.html', records=pagination.items,
+                               pagination=pagination, is_admin_view=True, is_archive_view=True)
+    
     # Build query based on filter
     query = BorrowRecord.query
     
@@ -525,14 +935,23 @@ def borrow_records():
     elif status_filter == 'returned':
         query = query.filter_by(status='returned')
     
-    # Update fines for all records
-    all_records = BorrowRecord.query.all()
-    for record in all_records:
-        if record.status in ['borrowed', 'overdue']:
-            record.calculate_fine()
+    # Update fines for active records
+    active_records = BorrowRecord.query.filter(
+        BorrowRecord.status.in_(['borrowed', 'overdue'])
+    ).all()
+    newly_overdue = False
+    for record in active_records:
+        was_overdue = record.status == 'overdue'
+        record.calculate_fine()
+        newly_overdue = newly_overdue or (record.status == 'overdue' and not was_overdue)
+    if newly_overdue:
+        bump(STATISTICS)
     db.session.commit()
     
-    records = query.order_by(BorrowRecord.borrow_date.desc()).all()
+    records = query.options(
+        db.joinedload(BorrowRecord.book),
+        db.joinedload(BorrowRecord.user)
+    ).order_by(BorrowRecord.borrow_date.desc()).all()
     
     return render_template('borrowrecord.html', records=records, is_admin_view=True)
 
@@ -550,22 +969,220 @@ def return_book(record_id):
     # Mark as returned
     record.mark_returned()
     
-    # Return book copy
+    # Return book copy, or set it aside for the next hold
     book = Book.query.get(record.book_id)
-    book.return_book()
+    hold = allocate_copy(book)
+    notify_returned(record, book)
     
+    bump(BOOKS, STATISTICS)
     db.session.commit()
     
     fine_msg = f' Fine: ₹{record.fine_amount}' if record.fine_amount > 0 else ''
-    flash(f'Book returned successfully.{fine_msg}', 'success')
+    hold_msg = f' Set the copy aside for {hold.user.username}\'s hold.' if hold else ''
+    flash(f'Book returned successfully.{fine_msg}{hold_msg}', 'success')
     
     return redirect(url_for('borrow_records'))
 
 
+def _get_id_list(field):
+    """Read a list of integer ids from a JSON body or repeated form fields"""
+    if request.is_json:
+        values = (request.get_json(silent=True) or {}).get(field) or []
+    else:
+        values = request.form.getlist(field)
+    
+    ids = []
+    for value in values:
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    
+    # Drop duplicates but keep the order the desk scanned them in
+    return list(dict.fromkeys(ids))
+
+
+def _batch_response(results, endpoint):
+    """Return a per-item summary as JSON, or flash it for form posts"""
+    succeeded = sum(1 for result in results if result['ok'])
+    failed = len(results) - succeeded
+    
+    if request.is_json:
+        return jsonify({
+            'succeeded': succeeded,
+            'failed': failed,
+            'results': results
+        })
+    
+    if succeeded:
+        flash(f'{succeeded} item(s) processed successfully.', 'success')
+    for result in results:
+        if not result['ok']:
+            flash(f'#{result["id"]}: {result["message"]}', 'warning')
+    if not results:
+        flash('No items were selected.', 'info')
+    
+    return redirect(url_for(endpoint))
+
+
+@app.route('/admin/return-books', methods=['POST'])
+@admin_required
+def return_books():
+    """Mark several borrow records as returned in one transaction"""
+    record_ids = _get_id_list('record_ids')
+    
+    records = {}
+    books = {}
+    if record_ids:
+        records = {
+            record.id: record
+            for record in BorrowRecord.query.filter(BorrowRecord.id.in_(record_ids)).all()
+        }
+        book_ids = {record.book_id for record in records.values()}
+        books = {
+            book.id: book
+            for book in Book.query.filter(Book.id.in_(book_ids)).all()
+        }
+    
+    results = []
+    for record_id in record_ids:
+        record = records.get(record_id)
+        if record is None:
+            results.append({'id': record_id, 'ok': False, 'message': 'Borrow record not found.'})
+            continue
+        
+        if record.status == 'returned':
+            results.append({'id': record_id, 'ok': False, 'message': 'This book has already been returned.'})
+            continue
+        
+        record.mark_returned()
+        hold = allocate_copy(books[record.book_id])
+        notify_returned(record, books[record.book_id])
+        
+        results.append({
+            'id': record_id,
+            'ok': True,
+            'book_id': record.book_id,
+            'fine_amount': record.fine_amount,
+            'hold_id': hold.id if hold else None
+        })
+    
+    if any(result['ok'] for result in results):
+        bump(BOOKS, STATISTICS)
+    db.session.commit()
+    
+    return _batch_response(results, 'borrow_records')
+
+
+@app.route('/admin/checkout-books', methods=['POST'])
+@admin_required
+def checkout_books():
+    """Lend several books to one user in one transaction"""
+    if request.is_json:
+        user_id = (request.get_json(silent=True) or {}).get('user_id')
+    else:
+        user_id = request.form.get('user_id')
+    
+    try:
+        user = User.query.get(int(user_id))
+    except (TypeError, ValueError):
+        user = None
+    
+    if user is None:
+        if request.is_json:
+            return jsonify({'error': 'User not found.'}), 404
+        flash('User not found.', 'danger')
+        return redirect(url_for('borrow_records'))
+    
+    book_ids = _get_id_list('book_ids')
+    
+    books = {}
+    already_borrowed = set()
+    active_holds = get_active_holds(user.id, book_ids)
+    if book_ids:
+        books = {
+            book.id: book
+            for book in Book.query.filter(Book.id.in_(book_ids)).all()
+        }
+        already_borrowed = {
+            book_id for (book_id,) in db.session.query(BorrowRecord.book_id).filter(
+                BorrowRecord.user_id == user.id,
+                BorrowRecord.book_id.in_(book_ids),
+                BorrowRecord.status.in_(['borrowed', 'overdue'])
+            )
+        }
+    
+    now = datetime.utcnow()
+    due_date = now + timedelta(days=Config.BORROW_PERIOD_DAYS)
+    
+    results = []
+    new_records = []
+    for book_id in book_ids:
+        book = books.get(book_id)
+        if book is None:
+            results.append({'id': book_id, 'ok': False, 'message': 'Book not found.'})
+            continue
+        
+        if book_id in already_borrowed:
+            results.append({'id': book_id, 'ok': False, 'message': 'User has already borrowed this book.'})
+            continue
+        
+        hold = active_holds.get(book_id)
+        if hold is not None and hold.status == 'ready':
+            # Lend the copy that was set aside for this user's hold
+            hold.status = 'fulfilled'
+        elif book.borrow():
+            if hold is not None:
+                hold.status = 'fulfilled'
+        else:
+            results.append({'id': book_id, 'ok': False, 'message': 'This book is not available for borrowing.'})
+            continue
+        
+        record = BorrowRecord(
+            user_id=user.id,
+            book_id=book_id,
+            borrow_date=now,
+            due_date=due_date,
+            status='borrowed'
+        )
+        new_records.append(record)
+        notify_borrowed(user.id, book, due_date)
+        results.append({'id': book_id, 'ok': True, 'record': record})
+    
+    db.session.add_all(new_records)
+    if new_records:
+        bump(BOOKS, STATISTICS)
+    db.session.commit()
+    
+    # Record ids only exist once the insert has been flushed
+    for result in results:
+        record = result.pop('record', None)
+        if record is not None:
+            result['record_id'] = record.id
+            result['due_date'] = record.due_date.strftime('%Y-%m-%d')
+    
+    return _batch_response(results, 'borrow_records')
+
+
+@app.route('/admin/reports/circulation')
+@admin_required
+def circulation_report():
+    """Daily borrow/return/overdue trends read from the rollup table"""
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    since = (datetime.utcnow() - timedelta(days=days - 1)).date()
+    
+    return render_template('circulationreport.html',
+                         days=days,
+                         daily=get_circulation_report(since, 'day'),
+                         by_category=get_circulation_report(since, 'category'),
+                         top_books=get_circulation_report(since, 'book', limit=10))
+
+
 # ==================== API Routes (for AJAX) ====================
 
 @app.route('/api/books/<int:book_id>')
 @login_required
+@cache_policy('private, max-age=30', etag=True)
 def get_book_details(book_id):
     """Get book details as JSON"""
     book = Book.query.get_or_404(book_id)
@@ -580,26 +1197,41 @@ def get_book_details(book_id):
         'description': book.description,
         'total_copies': book.total_copies,
         'available_copies': book.available_copies,
-        'is_available': book.is_available()
+        'is_available': book.is_available(),
+        'also_borrowed': get_also_borrowed([book.id], Config.RECOMMENDATIONS_TOP_K).get(book.id, [])
     })
 
 
 @app.route('/api/statistics')
 @admin_required
+@cache_policy('private, no-cache', etag=True)
 def get_statistics():
     """Get library statistics as JSON"""
-    total_books = Book.query.count()
-    total_users = User.query.filter_by(is_admin=False).count()
-    active_borrows = BorrowRecord.query.filter(
-        BorrowRecord.status.in_(['borrowed', 'overdue'])
-    ).count()
-    overdue_books = BorrowRecord.query.filter_by(status='overdue').count()
+    return jsonify(get_library_statistics())
+
+
+@app.route('/api/reports/circulation')
+@admin_required
+@cache_policy('private, max-age=300', etag=True)
+def get_circulation_trends():
+    """Get circulation trends from the daily rollups as JSON"""
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    group = request.args.get('group', 'day')
+    if group not in REPORT_GROUPS:
+        return jsonify({'error': f'group must be one of {", ".join(REPORT_GROUPS)}'}), 400
+    
+    since = (datetime.utcnow() - timedelta(days=days - 1)).date()
+    rows = get_circulation_report(
+        since,
+        group,
+        category=request.args.get('category') or None,
+        book_id=request.args.get('book_id', type=int)
+    )
     
     return jsonify({
-        'total_books': total_books,
-        'total_users': total_users,
-        'active_borrows': active_borrows,
-        'overdue_books': overdue_books
+        'since': since.isoformat(),
+        'group': group,
+        'rows': rows
     })
 
 
@@ -628,12 +1260,5 @@ def datetime_format(value, format='%Y-%m-%d'):
     return value.strftime(format)
 
 
-# Create tables on startup (for both local and production)
-with app.app_context():
-    try:
-        db.create_all()
-    except Exception as e:
-        print(f"Database initialization error: {e}")
-
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
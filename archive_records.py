@@ -0,0 +1,78 @@
+"""
+Move old returned borrow records into the archive table.
+Run this periodically (e.g. nightly from cron) so that borrow_records only
+holds active circulation and recent history.
+
+    python archive_records.py --days 365 --batch-size 1000
+"""
+
+import argparse
+from datetime import datetime, timedelta
+
+from config import Config
+from models import db, BorrowRecord, ArchivedBorrowRecord
+
+# Columns copied verbatim from borrow_records into borrow_records_archive
+ARCHIVE_COLUMNS = [
+    'user_id', 'book_id', 'borrow_date', 'due_date',
+    'return_date', 'status', 'fine_amount'
+]
+
+
+def archive_returned_records(older_than_days=None, batch_size=None):
+    """Move returned records older than the cutoff, one bounded batch per commit.
+
+    Returns the number of records archived.
+    """
+    if older_than_days is None:
+        older_than_days = Config.ARCHIVE_AFTER_DAYS
+    if batch_size is None:
+        batch_size = Config.ARCHIVE_BATCH_SIZE
+
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    source_columns = [getattr(BorrowRecord, name) for name in ARCHIVE_COLUMNS]
+    archived = 0
+
+    while True:
+        ids = [
+            record_id for (record_id,) in db.session.query(BorrowRecord.id).filter(
+                BorrowRecord.status == 'returned',
+                BorrowRecord.return_date < cutoff
+            ).order_by(BorrowRecord.id).limit(batch_size)
+        ]
+        if not ids:
+            break
+
+        # Copy and delete in the same transaction so a crash never loses or duplicates rows
+        db.session.execute(
+            db.insert(ArchivedBorrowRecord).from_select(
+                ['original_id'] + ARCHIVE_COLUMNS + ['archived_at'],
+                db.select(BorrowRecord.id, *source_columns, db.literal(datetime.utcnow())).where(
+                    BorrowRecord.id.in_(ids)
+                )
+            )
+        )
+        db.session.execute(
+            db.delete(BorrowRecord).where(BorrowRecord.id.in_(ids))
+        )
+        db.session.commit()
+
+        archived += len(ids)
+        print(f"Archived {archived} records...")
+
+    return archived
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive old returned borrow records')
+    parser.add_argument('--days', type=int, default=Config.ARCHIVE_AFTER_DAYS,
+                        help='archive records returned more than this many days ago')
+    parser.add_argument('--batch-size', type=int, default=Config.ARCHIVE_BATCH_SIZE,
+                        help='records moved per transaction')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        total = archive_returned_records(args.days, args.batch_size)
+        print(f"Done. {total} records archived.")
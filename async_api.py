@@ -0,0 +1,281 @@
+"""
+JSON API served on asyncio, for kiosks and other long-polling clients.
+
+The views mirror the /api routes in app.py but query through SQLAlchemy's
+async engine (aiosqlite or psycopg async) using the same models, so a
+waiting client costs a coroutine instead of a worker thread. The session
+cookie written by app.py is read here too, as long as SECRET_KEY matches.
+
+    hypercorn async_api:app --workers 2 --bind 0.0.0.0:8001
+
+Route /api/ to this server at the reverse proxy and everything else to
+the Flask app.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from functools import wraps
+
+from quart import Quart, jsonify, request, session
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from config import Config, get_async_database_url
+from models import User, Book, BorrowRecord, BookRecommendation
+from response_pipeline import cache_policy
+from sqlite_profile import apply_sqlite_profile
+from tenancy import load_tenants
+
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-production')
+
+engine = create_async_engine(
+    get_async_database_url(),
+    pool_size=Config.API_DB_POOL_SIZE,
+    max_overflow=Config.API_DB_MAX_OVERFLOW,
+    pool_pre_ping=True
+)
+if engine.dialect.name == 'sqlite' and Config.SQLITE_PROFILE:
+    # Same WAL and busy_timeout settings as the Flask app's connections
+    apply_sqlite_profile(engine.sync_engine, Config.SQLITE_PRAGMAS)
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+# Host names of library branches (multi-branch mode); this tier only serves the main database
+BRANCH_HOSTS = {
+    host.lower()
+    for tenant in load_tenants(Config.TENANTS_FILE).values()
+    for host in tenant.get('hosts', [])
+} if Config.TENANTS_FILE else set()
+
+
+def api_login_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Login required'}), 401
+        return await f(*args, **kwargs)
+    return decorated_function
+
+
+def api_admin_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Login required'}), 401
+        async with Session() as db_session:
+            user = await db_session.get(User, session['user_id'])
+        if not user or not user.is_admin:
+            return jsonify({'error': 'Admin access required'}), 403
+        return await f(*args, **kwargs)
+    return decorated_function
+
+
+@app.before_request
+async def refuse_branch_requests():
+    """User ids are only unique within a branch, so never answer a branch login from the main database"""
+    if session.get('tenant') or request.host.rsplit(':', 1)[0].lower() in BRANCH_HOSTS:
+        return jsonify({'error': 'Library branches are not served by this API'}), 404
+
+
+@app.after_request
+async def apply_cache_policy(response):
+    """The Cache-Control and ETag handling of response_pipeline, for the async views"""
+    view = app.view_functions.get(request.endpoint)
+    policy = getattr(view, 'cache_policy', None)
+    if policy is not None and response.status_code == 200:
+        value, etag = policy
+        response.headers['Cache-Control'] = value
+        if etag:
+            response.set_etag(hashlib.sha1(await response.get_data()).hexdigest(), weak=True)
+            if request.if_none_match.contains_weak(response.get_etag()[0]):
+                response.status_code = 304
+                response.set_data(b'')
+    return response
+
+
+async def get_also_borrowed(db_session, book_ids, limit=3):
+    """Async twin of get_also_borrowed() in app.py"""
+    if not book_ids:
+        return {}
+
+    rows = await db_session.execute(
+        select(
+            BookRecommendation.book_id,
+            BookRecommendation.score,
+            Book.id,
+            Book.title,
+            Book.author
+        ).join(Book, Book.id == BookRecommendation.recommended_book_id).where(
+            BookRecommendation.book_id.in_(book_ids),
+            BookRecommendation.rank < limit
+        ).order_by(BookRecommendation.book_id, BookRecommendation.rank)
+    )
+
+    also_borrowed = {}
+    for book_id, score, other_id, title, author in rows:
+        also_borrowed.setdefault(book_id, []).append({
+            'id': other_id,
+            'title': title,
+            'author': author,
+            'score': score
+        })
+    return also_borrowed
+
+
+def _availability(book):
+    return {
+        'id': book.id,
+        'available_copies': book.available_copies,
+        'is_available': book.is_available(),
+        'version': book.updated_at.isoformat() if book.updated_at else None
+    }
+
+
+@app.route('/api/books/<int:book_id>')
+@api_login_required
+@cache_policy('private, max-age=30', etag=True)
+async def get_book_details(book_id):
+    """Get book details as JSON"""
+    async with Session() as db_session:
+        book = await db_session.get(Book, book_id)
+        if book is None:
+            return jsonify({'error': 'Book not found'}), 404
+        also_borrowed = await get_also_borrowed(db_session, [book.id], Config.RECOMMENDATIONS_TOP_K)
+
+    return jsonify({
+        'id': book.id,
+        'title': book.title,
+        'author': book.author,
+        'isbn': book.isbn,
+        'publisher': book.publisher,
+        'publication_year': book.publication_year,
+        'category': book.category,
+        'description': book.description,
+        'total_copies': book.total_copies,
+        'available_copies': book.available_copies,
+        'is_available': book.is_available(),
+        'also_borrowed': also_borrowed.get(book.id, [])
+    })
+
+
+class AvailabilityWatcher:
+    """One polling loop per worker for every long-polling client.
+
+    Waiting clients register the book and version they have seen. Every
+    interval the loop reads all watched books in one query and wakes the
+    clients whose book changed, so the database load does not grow with the
+    number of waiting clients.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._waiters = {}  # book_id -> list of (version, future)
+        self._task = None
+
+    async def wait(self, book_id, version, timeout):
+        """The book's availability once it differs from version, None if deleted.
+
+        Raises asyncio.TimeoutError if nothing changed within timeout seconds.
+        """
+        waiter = (version, asyncio.get_running_loop().create_future())
+        self._waiters.setdefault(book_id, []).append(waiter)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll())
+        try:
+            return await asyncio.wait_for(waiter[1], timeout)
+        finally:
+            waiters = self._waiters.get(book_id, [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+            if not waiters:
+                self._waiters.pop(book_id, None)
+
+    async def _poll(self):
+        while self._waiters:
+            await asyncio.sleep(self.interval)
+            book_ids = list(self._waiters)
+            try:
+                async with Session() as db_session:
+                    books = {
+                        book.id: _availability(book)
+                        for book in await db_session.scalars(select(Book).where(Book.id.in_(book_ids)))
+                    }
+            except Exception:
+                # Waiters time out on their own; keep the loop alive for the next interval
+                logger.exception('Availability poll failed')
+                continue
+
+            for book_id in book_ids:
+                availability = books.get(book_id)
+                for version, future in self._waiters.get(book_id, []):
+                    if future.done():
+                        continue
+                    if availability is None or availability['version'] != version:
+                        future.set_result(availability)
+
+
+availability_watcher = AvailabilityWatcher(Config.API_POLL_INTERVAL)
+
+
+@app.route('/api/books/<int:book_id>/availability')
+@api_login_required
+async def wait_for_availability(book_id):
+    """Long-poll a book's availability.
+
+    Pass the `version` from the previous response; the request is held until
+    the book changes or `wait` seconds (at most API_LONG_POLL_SECONDS) pass.
+    """
+    version = request.args.get('version')
+    wait = min(max(request.args.get('wait', 0, type=float), 0), Config.API_LONG_POLL_SECONDS)
+
+    async with Session() as db_session:
+        book = await db_session.get(Book, book_id)
+    if book is None:
+        return jsonify({'error': 'Book not found'}), 404
+
+    availability = _availability(book)
+    if availability['version'] == version and wait:
+        try:
+            availability = await availability_watcher.wait(book_id, version, wait)
+        except asyncio.TimeoutError:
+            pass  # Unchanged: answer with what the client already has
+        if availability is None:
+            return jsonify({'error': 'Book not found'}), 404
+    return jsonify(availability)
+
+
+@app.route('/api/statistics')
+@api_admin_required
+@cache_policy('private, no-cache', etag=True)
+async def get_statistics():
+    """Get library statistics as JSON"""
+    async with Session() as db_session:
+        total_books = await db_session.scalar(select(func.count(Book.id)))
+        total_users = await db_session.scalar(
+            select(func.count(User.id)).where(User.is_admin.is_(False))
+        )
+        status_counts = dict((await db_session.execute(
+            select(BorrowRecord.status, func.count(BorrowRecord.id)).where(
+                BorrowRecord.status.in_(['borrowed', 'overdue'])
+            ).group_by(BorrowRecord.status)
+        )).all())
+
+    return jsonify({
+        'total_books': total_books,
+        'total_users': total_users,
+        'active_borrows': sum(status_counts.values()),
+        'overdue_books': status_counts.get('overdue', 0)
+    })
+
+
+@app.after_serving
+async def dispose_engine():
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    app.run(debug=True, port=8001)
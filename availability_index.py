@@ -0,0 +1,182 @@
+"""
+Per-worker availability index for catalog browsing.
+
+Keeps the book id, category and available copies of every book in three
+parallel NumPy arrays, so "available books in category X, page N" is a
+couple of vectorized comparisons instead of a query that loads every Book
+row. Only the books on the page being shown are then read from the database.
+
+The index is built on first use. It registers with the cache_bus tracker
+under BOOKS, so a checkout, return or book edit in any worker marks it
+stale. The next lookup then reads only the rows whose updated_at moved since
+the newest change it has seen. The delete paths also bump DELETED_BOOKS,
+which makes the next lookup rebuild the index instead; a row count mismatch
+does the same for deletes made outside the app.
+"""
+
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from flask_sqlalchemy.pagination import Pagination
+
+from cache_bus import BOOKS, DELETED_BOOKS
+from models import db, Book
+
+_Snapshot = namedtuple('_Snapshot', 'ids categories available category_codes watermark loaded_at')
+
+
+class AvailabilityIndex:
+    """(book id, category, available copies) of every book, per worker and database"""
+
+    def __init__(self, tracker, max_age, overlap_seconds):
+        self.names = {BOOKS}
+        self.tracker = tracker
+        self.max_age = max_age
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self._snapshots = {}  # scope -> _Snapshot, replaced as a whole on refresh
+        self._stale = set()
+        self._deleted = set()  # Scopes that must be rebuilt rather than caught up
+        self._lock = threading.Lock()
+        tracker.register(self)
+        tracker.register(_DeletionWatch(self))
+
+    def clear(self, scope=None):
+        """Called by the tracker when BOOKS is bumped: catch up on the next lookup"""
+        self._stale.add(scope)
+
+    def book_ids(self, category=None, available_only=False):
+        """Ids of the matching books in catalog (id) order, as a NumPy array"""
+        snapshot = self._snapshot()
+        mask = None
+        if category:
+            code = snapshot.category_codes.get(category)
+            if code is None:
+                return snapshot.ids[:0]
+            mask = snapshot.categories == code
+        if available_only:
+            in_stock = snapshot.available > 0
+            mask = in_stock if mask is None else mask & in_stock
+        return snapshot.ids if mask is None else snapshot.ids[mask]
+
+    def _is_current(self, scope, snapshot):
+        return (snapshot is not None and scope not in self._stale and scope not in self._deleted
+                and time.monotonic() - snapshot.loaded_at < self.max_age)
+
+    def _snapshot(self):
+        scope = self.tracker.scope()
+        snapshot = self._snapshots.get(scope)
+        if self._is_current(scope, snapshot):
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshots.get(scope)
+            if self._is_current(scope, snapshot):
+                return snapshot
+            # Cleared before reading, so a bump that lands during the read marks it again
+            self._stale.discard(scope)
+            if snapshot is None or scope in self._deleted:
+                self._deleted.discard(scope)
+                snapshot = self._build()
+            else:
+                snapshot = self._catch_up(snapshot)
+            self._snapshots[scope] = snapshot
+        return snapshot
+
+    def _read(self, since=None):
+        query = db.select(Book.id, Book.category, Book.available_copies, Book.updated_at)
+        if since is not None:
+            query = query.where(Book.updated_at >= since)
+        return db.session.execute(query.order_by(Book.id)).all()
+
+    def _build(self):
+        # Imported here so workers that never browse the catalog do not pay for NumPy
+        import numpy as np
+
+        rows = self._read()
+        category_codes = {}
+        return _Snapshot(
+            ids=np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows)),
+            categories=np.fromiter(
+                (category_codes.setdefault(row.category, len(category_codes)) for row in rows),
+                dtype=np.int32, count=len(rows)
+            ),
+            available=np.fromiter((row.available_copies for row in rows), dtype=np.int32, count=len(rows)),
+            category_codes=category_codes,
+            watermark=max((row.updated_at for row in rows if row.updated_at), default=None),
+            loaded_at=time.monotonic()
+        )
+
+    def _catch_up(self, snapshot):
+        import numpy as np
+
+        if snapshot.watermark is None:
+            return self._build()
+        # Re-read a little before the newest change seen, for transactions that committed late
+        rows = self._read(snapshot.watermark - self.overlap)
+        total = db.session.query(db.func.count(Book.id)).scalar()
+
+        ids = snapshot.ids
+        categories = snapshot.categories.copy()
+        available = snapshot.available.copy()
+        category_codes = dict(snapshot.category_codes)
+
+        if rows:
+            changed_ids = np.array([row.id for row in rows], dtype=np.int64)
+            changed_categories = np.array(
+                [category_codes.setdefault(row.category, len(category_codes)) for row in rows],
+                dtype=np.int32
+            )
+            changed_available = np.array([row.available_copies for row in rows], dtype=np.int32)
+
+            positions = np.searchsorted(ids, changed_ids)
+            known = positions < len(ids)
+            known[known] = ids[positions[known]] == changed_ids[known]
+            categories[positions[known]] = changed_categories[known]
+            available[positions[known]] = changed_available[known]
+
+            new = ~known
+            if new.any():
+                ids = np.concatenate([ids, changed_ids[new]])
+                categories = np.concatenate([categories, changed_categories[new]])
+                available = np.concatenate([available, changed_available[new]])
+                order = np.argsort(ids, kind='stable')
+                ids, categories, available = ids[order], categories[order], available[order]
+
+        if len(ids) != total:
+            # Books were deleted without a DELETED_BOOKS bump; deletes are rare, so start over
+            return self._build()
+
+        return _Snapshot(
+            ids=ids,
+            categories=categories,
+            available=available,
+            category_codes=category_codes,
+            watermark=max([snapshot.watermark] + [row.updated_at for row in rows if row.updated_at]),
+            loaded_at=time.monotonic()
+        )
+
+
+class _DeletionWatch:
+    """Registered with the tracker next to the index, to tell deletes from other changes"""
+
+    def __init__(self, index):
+        self.names = {DELETED_BOOKS}
+        self.index = index
+
+    def clear(self, scope=None):
+        self.index._deleted.add(scope)
+
+
+class BookIdPagination(Pagination):
+    """Pagination over a list of book ids that loads only the current page's books"""
+
+    def _query_items(self):
+        page_ids = [int(book_id) for book_id in
+                    self._query_args['ids'][self._query_offset:self._query_offset + self.per_page]]
+        books = {book.id: book for book in Book.query.filter(Book.id.in_(page_ids))}
+        return [books[book_id] for book_id in page_ids if book_id in books]
+
+    def _query_count(self):
+        return len(self._query_args['ids'])
@@ -0,0 +1,142 @@
+"""
+Load test for the JSON API: the sync Flask views against async_api.py.
+
+Logs in through the Flask app once, then opens many keep-alive connections
+and has each one request the same path in a loop for the given duration.
+Only the standard library is used, so the client itself stays cheap.
+
+    gunicorn app:app --workers 4 --bind 127.0.0.1:5000
+    hypercorn async_api:app --workers 2 --bind 127.0.0.1:8001
+
+    python benchmarks/api_load.py http://127.0.0.1:5000 --clients 200
+    python benchmarks/api_load.py http://127.0.0.1:8001 --login-url http://127.0.0.1:5000 --clients 200
+
+Long-polling kiosks can be simulated by pointing --path at
+/api/books/1/availability?version=x&wait=20 with a few thousand clients.
+"""
+
+import argparse
+import asyncio
+import http.cookiejar
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+
+def login(base_url, username, password):
+    """Return the session cookie header from a normal form login"""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    data = urllib.parse.urlencode({'user': username, 'pass': password}).encode()
+    opener.open(f'{base_url}/login', data=data)
+    cookies = '; '.join(f'{cookie.name}={cookie.value}' for cookie in jar)
+    if 'session=' not in cookies:
+        raise SystemExit(f'Login as {username} failed')
+    return cookies
+
+
+async def _read_response(reader):
+    """Read one HTTP/1.1 response; return (status code, whether the connection stays open)"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    version, status = status_line.split()[:2]
+    keep_alive = version == b'HTTP/1.1'
+
+    length = 0
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding' and 'chunked' in value.lower():
+            chunked = True
+        elif name == 'connection':
+            keep_alive = value.strip().lower() != 'close'
+
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return int(status), keep_alive
+
+
+async def _client(host, port, request, deadline, latencies, errors):
+    reader = writer = None
+    while time.monotonic() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            started = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, keep_alive = await _read_response(reader)
+            if status >= 400:
+                errors.append(status)
+            else:
+                latencies.append(time.perf_counter() - started)
+            if not keep_alive:
+                writer.close()
+                reader = writer = None
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError) as error:
+            errors.append(type(error).__name__)
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+
+async def run(base_url, path, cookies, clients, duration):
+    url = urllib.parse.urlsplit(base_url)
+    host, port = url.hostname, url.port or 80
+    request = (
+        f'GET {path} HTTP/1.1\r\n'
+        f'Host: {url.netloc}\r\n'
+        f'Cookie: {cookies}\r\n'
+        f'Connection: keep-alive\r\n\r\n'
+    ).encode()
+
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    started = time.monotonic()
+    await asyncio.gather(*(
+        _client(host, port, request, deadline, latencies, errors) for _ in range(clients)
+    ))
+    return latencies, errors, time.monotonic() - started
+
+
+def report(latencies, errors, elapsed):
+    print(f"Requests:   {len(latencies)} ok, {len(errors)} failed in {elapsed:.1f}s")
+    print(f"Throughput: {len(latencies) / elapsed:.0f} req/s")
+    if latencies:
+        latencies.sort()
+        p50, p95, p99 = (latencies[int(len(latencies) * q)] * 1000 for q in (0.50, 0.95, 0.99))
+        print(f"Latency:    p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+    if errors:
+        print(f"Errors:     {dict(Counter(errors))}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the JSON API')
+    parser.add_argument('base_url', help='server under test, e.g. http://127.0.0.1:8001')
+    parser.add_argument('--login-url', help='Flask app used to log in (default: base_url)')
+    parser.add_argument('--path', default='/api/books/1')
+    parser.add_argument('--clients', type=int, default=100, help='concurrent connections')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run')
+    parser.add_argument('--user', default='admin')
+    parser.add_argument('--password', default='admin123')
+    args = parser.parse_args()
+
+    cookies = login(args.login_url or args.base_url, args.user, args.password)
+    report(*asyncio.run(run(args.base_url, args.path, cookies, args.clients, args.duration)))
@@ -0,0 +1,108 @@
+"""
+Time from starting a worker process to its first responses.
+
+Each run starts a fresh interpreter, the way gunicorn starts a worker, and
+times the first request to every main page through the test client:
+
+  cold      import the app, compile every template on first use
+  bytecode  import the app, load templates from the precompiled bytecode cache
+  preload   import and app.warm_up() in a parent, then fork and time the child,
+            which is what a worker gets from gunicorn.conf.py
+
+    python benchmarks/cold_start.py --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGES = ['/books', '/dashboard', '/my-books', '/admin', '/admin/books', '/admin/users',
+         '/admin/borrow-records']
+
+
+def _first_responses(app, started):
+    """Request the login page, then every page as the admin; returns timings in ms"""
+    from models import User
+
+    client = app.test_client()
+    client.get('/')
+    first = time.time() - started
+
+    with app.app_context():
+        admin = User.query.filter_by(is_admin=True).first()
+    with client.session_transaction() as warm_session:
+        warm_session.update(user_id=admin.id, username=admin.username, is_admin=True)
+    for path in PAGES:
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+    return {'first': first * 1000, 'all': (time.time() - started) * 1000}
+
+
+def _child(mode, started):
+    sys.path.insert(0, ROOT)
+    from app import app
+
+    if mode != 'preload':
+        print(json.dumps(_first_responses(app, started)))
+        return
+
+    from app import warm_up
+
+    warm_up()
+    sys.stdout.flush()
+    forked = time.time()
+    pid = os.fork()
+    if pid == 0:
+        print(json.dumps(_first_responses(app, forked)))
+        sys.stdout.flush()
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+
+def _run(mode, env):
+    env = dict(env, COLD_START_AT=repr(time.time()))
+    output = subprocess.run([sys.executable, __file__, '--child', mode], env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(runs):
+    directory = tempfile.mkdtemp(prefix='libwise-cold-')
+    bytecode_dir = os.path.join(directory, 'jinja_cache')
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(directory, 'cold.db')}",
+               JINJA_BYTECODE_CACHE_DIR='')
+    subprocess.run([sys.executable, '-c', 'import init_db; init_db.init_database()'],
+                   cwd=ROOT, env=env, capture_output=True, check=True)
+    subprocess.run([sys.executable, 'precompile_templates.py'], cwd=ROOT, capture_output=True,
+                   env=dict(env, JINJA_BYTECODE_CACHE_DIR=bytecode_dir), check=True)
+
+    modes = {
+        'cold': env,
+        'bytecode': dict(env, JINJA_BYTECODE_CACHE_DIR=bytecode_dir),
+        'preload': dict(env, JINJA_BYTECODE_CACHE_DIR=bytecode_dir),
+    }
+    print(f"median of {runs} runs, {len(PAGES) + 1} pages\n")
+    print(f"{'':<10}{'first response ms':>20}{'all pages ms':>16}")
+    for mode, mode_env in modes.items():
+        results = [_run(mode, mode_env) for _ in range(runs)]
+        print(f"{mode:<10}{statistics.median(r['first'] for r in results):>20.0f}"
+              f"{statistics.median(r['all'] for r in results):>16.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Worker cold start benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', choices=['cold', 'bytecode', 'preload'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, float(os.environ['COLD_START_AT']))
+    else:
+        main(args.runs)
@@ -0,0 +1,157 @@
+"""
+Concurrent read/write throughput on SQLite, default settings vs. sqlite_profile.
+
+Reader and writer processes (standing in for gunicorn workers) hit a fresh
+database file for a fixed time. Readers page through the catalog; writers
+borrow books in short read-then-write transactions like borrow_book does.
+
+Three runs are compared: SQLite defaults, the profile's PRAGMAs with plain
+deferred BEGIN, and the full profile with BEGIN IMMEDIATE for writers. The
+middle run shows why writers must be serialized: in WAL mode a deferred
+transaction that read an older snapshot cannot be upgraded to a writer and
+fails at once instead of waiting for busy_timeout.
+
+    python benchmarks/sqlite_concurrency.py --readers 4 --writers 4 --duration 10
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, insert, select, update  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from config import Config  # noqa: E402
+from models import db, User, Book, BorrowRecord  # noqa: E402
+from sqlite_profile import apply_sqlite_profile, immediate_transactions  # noqa: E402
+
+BOOKS = 500
+USERS = 100
+
+
+MODES = (
+    ('default', 'SQLite defaults'),
+    ('deferred', 'profile PRAGMAs, deferred BEGIN'),
+    ('profile', 'full profile, BEGIN IMMEDIATE'),
+)
+
+
+def _engine(path, mode):
+    engine = create_engine(f'sqlite:///{path}')
+    if mode != 'default':
+        apply_sqlite_profile(engine, Config.SQLITE_PRAGMAS)
+    return engine
+
+
+def _setup(path, mode):
+    engine = _engine(path, mode)
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(User), [
+            {'username': f'user{i}', 'password_hash': 'x', 'full_name': f'User {i}', 'is_admin': False}
+            for i in range(USERS)
+        ])
+        connection.execute(insert(Book), [
+            {'title': f'Book {i}', 'author': 'Author', 'isbn': f'isbn-{i}', 'category': 'General',
+             'total_copies': 1000, 'available_copies': 1000}
+            for i in range(BOOKS)
+        ])
+    engine.dispose()
+
+
+def _reader(path, mode, deadline, results):
+    engine = _engine(path, mode)
+    done = errors = 0
+    while time.time() < deadline:
+        try:
+            with engine.connect() as connection:
+                connection.execute(select(func.count(Book.id))).scalar()
+                connection.execute(
+                    select(Book).order_by(Book.id).limit(Config.BOOKS_PER_PAGE)
+                    .offset(random.randrange(BOOKS))
+                ).all()
+                connection.execute(
+                    select(func.count(BorrowRecord.id)).where(BorrowRecord.status == 'borrowed')
+                ).scalar()
+            done += 1
+        except OperationalError:
+            errors += 1
+    results.put(('read', done, errors))
+
+
+def _writer(path, mode, deadline, results):
+    engine = _engine(path, mode)
+    begin_immediate = immediate_transactions if mode == 'profile' else nullcontext
+    done = errors = 0
+    while time.time() < deadline:
+        try:
+            # Same shape as borrow_book: read the book, then update it and insert a record
+            with begin_immediate(), engine.begin() as connection:
+                book_id = random.randrange(1, BOOKS + 1)
+                available = connection.execute(
+                    select(Book.available_copies).where(Book.id == book_id)
+                ).scalar()
+                if available:
+                    connection.execute(
+                        update(Book).where(Book.id == book_id)
+                        .values(available_copies=Book.available_copies - 1)
+                    )
+                    now = datetime.utcnow()
+                    connection.execute(insert(BorrowRecord).values(
+                        user_id=random.randrange(1, USERS + 1), book_id=book_id,
+                        borrow_date=now, due_date=now + timedelta(days=14), status='borrowed'
+                    ))
+            done += 1
+        except OperationalError:
+            errors += 1
+    results.put(('write', done, errors))
+
+
+def run(mode, readers, writers, duration):
+    directory = tempfile.mkdtemp(prefix='libwise-bench-')
+    path = os.path.join(directory, 'bench.db')
+    _setup(path, mode)
+
+    results = multiprocessing.Queue()
+    deadline = time.time() + duration
+    processes = [
+        multiprocessing.Process(target=_reader, args=(path, mode, deadline, results))
+        for _ in range(readers)
+    ] + [
+        multiprocessing.Process(target=_writer, args=(path, mode, deadline, results))
+        for _ in range(writers)
+    ]
+    for process in processes:
+        process.start()
+
+    totals = {'read': [0, 0], 'write': [0, 0]}
+    for _ in processes:
+        kind, done, errors = results.get()
+        totals[kind][0] += done
+        totals[kind][1] += errors
+    for process in processes:
+        process.join()
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SQLite concurrency benchmark')
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10, help='seconds per run')
+    args = parser.parse_args()
+
+    print(f"{args.readers} readers, {args.writers} writers, {args.duration:.0f}s per run\n")
+    print(f"{'':<34}{'reads/s':>10}{'writes/s':>10}{'read errors':>14}{'write errors':>14}")
+    for mode, label in MODES:
+        totals = run(mode, args.readers, args.writers, args.duration)
+        print(f"{label:<34}{totals['read'][0] / args.duration:>10.0f}{totals['write'][0] / args.duration:>10.0f}"
+              f"{totals['read'][1]:>14}{totals['write'][1]:>14}")
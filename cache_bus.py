@@ -0,0 +1,155 @@
+"""
+Cross-worker cache invalidation through the cache_versions table.
+
+Every write that changes cached data calls bump() with the kinds of data it
+touched, inside its own transaction:
+
+    book.borrow()
+    bump(BOOKS, STATISTICS)
+    db.session.commit()
+
+Each worker keeps a CacheVersionTracker that reads the (tiny) version table
+at most once per interval and clears its VersionedCaches whose versions
+moved. Caches in the worker that made the write are cleared as soon as the
+transaction commits, so an admin always sees their own change.
+
+In multi-branch mode every branch database has its own cache_versions table,
+so versions and cached values are kept per scope (the current branch).
+"""
+
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, CacheVersion
+
+BOOKS = 'books'
+CATEGORIES = 'categories'
+STATISTICS = 'statistics'
+DELETED_BOOKS = 'deleted_books'  # Books were deleted, not just changed
+
+_PENDING_KEY = 'cache_bus_bumped'
+
+
+def bump(*names):
+    """Increment the versions of names as part of the current transaction"""
+    names = sorted(set(names))  # Same lock order in every transaction
+    if not names:
+        return
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    if insert is not None:
+        db.session.execute(
+            insert(CacheVersion).values([{'name': name, 'version': 1} for name in names])
+            .on_conflict_do_update(index_elements=[CacheVersion.name],
+                                   set_={'version': CacheVersion.version + 1})
+        )
+    else:
+        for name in names:
+            updated = db.session.execute(
+                db.update(CacheVersion).where(CacheVersion.name == name)
+                .values(version=CacheVersion.version + 1)
+            ).rowcount
+            if not updated:
+                db.session.add(CacheVersion(name=name, version=1))
+
+    db.session.info.setdefault(_PENDING_KEY, set()).update(names)
+
+
+class VersionedCache:
+    """In-process cache dropped whenever one of its version names is bumped"""
+
+    def __init__(self, tracker, *names, max_entries=1024):
+        self.names = set(names)
+        self.max_entries = max_entries
+        self.tracker = tracker
+        self._entries = {}  # scope -> {key: value}
+        self._lock = threading.Lock()
+        tracker.register(self)
+
+    def get_or_set(self, key, loader):
+        scope = self.tracker.scope()
+        with self._lock:
+            entries = self._entries.get(scope)
+            if entries is not None and key in entries:
+                return entries[key]
+
+        value = loader()
+        with self._lock:
+            entries = self._entries.setdefault(scope, {})
+            if len(entries) >= self.max_entries:
+                entries.clear()
+            entries[key] = value
+        return value
+
+    def clear(self, scope=None):
+        with self._lock:
+            self._entries.pop(scope, None)
+
+
+class CacheVersionTracker:
+    """Notices version bumps made by any worker and clears the affected caches"""
+
+    def __init__(self, interval, scope=None):
+        self.interval = interval
+        self.scope = scope or (lambda: None)
+        self._versions = {}  # scope -> {name: version}
+        self._checked_at = {}  # scope -> monotonic time of the last read
+        self._caches = []
+        self._lock = threading.Lock()
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+
+    def register(self, cache):
+        self._caches.append(cache)
+
+    def invalidate(self, names, scope=None):
+        """Clear the caches of scope that depend on any of names"""
+        for cache in self._caches:
+            if cache.names & names:
+                cache.clear(scope)
+
+    def _due(self, scope, now):
+        checked_at = self._checked_at.get(scope)
+        return checked_at is None or now - checked_at >= self.interval
+
+    def refresh(self):
+        """Read cache_versions if the interval has passed; call before serving a request"""
+        scope = self.scope()
+        now = time.monotonic()
+        if not self._due(scope, now):
+            return
+
+        with self._lock:
+            if not self._due(scope, now):
+                return
+            versions = dict(db.session.execute(
+                db.select(CacheVersion.name, CacheVersion.version)
+            ).all())
+            known = self._versions.get(scope, {})
+            changed = {
+                name for name in versions.keys() | known.keys()
+                if versions.get(name) != known.get(name)
+            }
+            self._versions[scope] = versions
+            self._checked_at[scope] = now
+
+        if changed:
+            self.invalidate(changed, scope)
+
+    def _after_commit(self, session):
+        names = session.info.pop(_PENDING_KEY, None)
+        if names:
+            self.invalidate(names, self.scope())
+
+    def _after_rollback(self, session):
+        session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,229 @@
+"""
+Daily circulation rollups for the admin trend reports.
+
+The incremental job only reads borrow, return and overdue events that happened
+after its watermark, so it can run every few minutes from cron. Events are
+stamped before their transaction commits, so each run stops
+ROLLUP_SETTLE_SECONDS short of now and a late commit is still counted:
+
+    python circulation_rollups.py
+    python circulation_rollups.py --backfill 2025-01-01 2025-12-31
+"""
+
+import argparse
+from datetime import date, datetime, time, timedelta
+
+from config import Config
+from models import db, Book, BorrowRecord, ArchivedBorrowRecord, CirculationRollup, JobWatermark
+
+WATERMARK_NAME = 'circulation_rollup'
+
+# Report groupings supported by get_circulation_report()
+REPORT_GROUPS = ('day', 'category', 'book')
+
+
+def _as_date(value):
+    """SQLite returns date() as text, PostgreSQL as a date"""
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+
+def _count_events(model, column, start, end, *criteria):
+    """Count events per (day, book) for one timestamp column in (start, end]"""
+    day = db.func.date(column)
+    query = db.session.query(day, model.book_id, db.func.count()).filter(
+        column > start,
+        column <= end,
+        *criteria
+    ).group_by(day, model.book_id)
+    return [(_as_date(event_day), book_id, count) for event_day, book_id, count in query]
+
+
+def _collect_counts(start, end, include_archive):
+    """Aggregate borrow, return and overdue events in (start, end] into {(day, book_id): [b, r, o]}"""
+    models = [BorrowRecord, ArchivedBorrowRecord] if include_archive else [BorrowRecord]
+    counts = {}
+
+    for model in models:
+        events = [
+            (0, _count_events(model, model.borrow_date, start, end)),
+            (1, _count_events(model, model.return_date, start, end)),
+            # A record becomes overdue on its due date unless it was back by then
+            (2, _count_events(model, model.due_date, start, end, db.or_(
+                model.return_date.is_(None),
+                model.return_date > model.due_date
+            ))),
+        ]
+        for index, rows in events:
+            for event_day, book_id, count in rows:
+                counts.setdefault((event_day, book_id), [0, 0, 0])[index] += count
+
+    return counts
+
+
+def _write_counts(counts):
+    """Add counts to the matching rollup rows, creating them as needed"""
+    if not counts:
+        return
+
+    book_ids = {book_id for _, book_id in counts}
+    categories = dict(
+        db.session.query(Book.id, Book.category).filter(Book.id.in_(book_ids))
+    )
+
+    days = {event_day for event_day, _ in counts}
+    existing = {
+        (rollup.day, rollup.book_id): rollup
+        for rollup in CirculationRollup.query.filter(
+            CirculationRollup.day.in_(days),
+            CirculationRollup.book_id.in_(book_ids)
+        )
+    }
+
+    for (event_day, book_id), (borrows, returns, overdues) in counts.items():
+        rollup = existing.get((event_day, book_id))
+        if rollup is None:
+            rollup = CirculationRollup(
+                day=event_day,
+                book_id=book_id,
+                category=categories.get(book_id),
+                borrows=0,
+                returns=0,
+                overdues=0
+            )
+            db.session.add(rollup)
+
+        rollup.borrows += borrows
+        rollup.returns += returns
+        rollup.overdues += overdues
+        if book_id in categories:
+            rollup.category = categories[book_id]
+
+
+def _get_watermark():
+    return db.session.get(JobWatermark, WATERMARK_NAME)
+
+
+def _set_watermark(watermark, value):
+    if watermark is None:
+        db.session.add(JobWatermark(name=WATERMARK_NAME, value=value))
+    else:
+        watermark.value = value
+
+
+def _settled(now=None):
+    """Latest time whose events have all been committed"""
+    return (now or datetime.utcnow()) - timedelta(seconds=Config.ROLLUP_SETTLE_SECONDS)
+
+
+def update_rollups(now=None):
+    """Roll up every settled event since the last watermark. Returns the new watermark."""
+    watermark = _get_watermark()
+    start = watermark.value if watermark else datetime.min
+    end = max(start, _settled(now))
+
+    # Records only reach the archive long after their events were rolled up
+    archive_cutoff = end - timedelta(days=Config.ARCHIVE_AFTER_DAYS)
+    counts = _collect_counts(start, end, include_archive=start < archive_cutoff)
+
+    _write_counts(counts)
+    _set_watermark(watermark, end)
+    db.session.commit()
+    return end
+
+
+def backfill_rollups(start_day, end_day):
+    """Recompute the rollups for whole days in [start_day, end_day].
+
+    Running it twice for the same range gives the same result. Events after
+    the incremental watermark are left for update_rollups() to pick up.
+    """
+    watermark = _get_watermark()
+    end = datetime.combine(end_day, time.max)
+    if watermark is not None:
+        end = min(end, watermark.value)
+    else:
+        end = min(end, _settled())
+    start = datetime.combine(start_day, time.min) - timedelta(microseconds=1)
+
+    CirculationRollup.query.filter(
+        CirculationRollup.day >= start_day,
+        CirculationRollup.day <= end_day
+    ).delete(synchronize_session=False)
+
+    counts = _collect_counts(start, end, include_archive=True)
+    _write_counts(counts)
+
+    if watermark is None:
+        _set_watermark(watermark, end)
+    db.session.commit()
+    return len(counts)
+
+
+def get_circulation_report(since, group='day', category=None, book_id=None, limit=None):
+    """Read aggregated circulation counts from the rollup table only"""
+    if group == 'category':
+        key = CirculationRollup.category
+    elif group == 'book':
+        key = CirculationRollup.book_id
+    else:
+        key = CirculationRollup.day
+
+    borrows = db.func.sum(CirculationRollup.borrows)
+    query = db.session.query(
+        key,
+        borrows,
+        db.func.sum(CirculationRollup.returns),
+        db.func.sum(CirculationRollup.overdues)
+    ).filter(CirculationRollup.day >= since)
+
+    if category:
+        query = query.filter(CirculationRollup.category == category)
+    if book_id:
+        query = query.filter(CirculationRollup.book_id == book_id)
+
+    query = query.group_by(key)
+    if group == 'day':
+        query = query.order_by(key)
+    else:
+        query = query.order_by(borrows.desc())
+    if limit:
+        query = query.limit(limit)
+
+    rows = [
+        {
+            group: _as_date(value).isoformat() if group == 'day' else value,
+            'borrows': int(borrow_count or 0),
+            'returns': int(return_count or 0),
+            'overdues': int(overdue_count or 0)
+        }
+        for value, borrow_count, return_count, overdue_count in query
+    ]
+
+    if group == 'book' and rows:
+        titles = dict(db.session.query(Book.id, Book.title).filter(
+            Book.id.in_([row['book'] for row in rows])
+        ))
+        for row in rows:
+            row['title'] = titles.get(row['book'], 'Deleted book')
+
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update the daily circulation rollups')
+    parser.add_argument('--backfill', nargs=2, metavar=('START', 'END'),
+                        type=date.fromisoformat,
+                        help='recompute whole days from START to END (YYYY-MM-DD)')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        if args.backfill:
+            rows = backfill_rollups(*args.backfill)
+            print(f"Backfilled {rows} rollup rows.")
+        else:
+            watermark = update_rollups()
+            print(f"Rollups updated up to {watermark}.")
@@ -4,6 +4,37 @@ Modify these settings according to your requirements
 """
 
 import os
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_database_url():
+    """DATABASE_URL rewritten for SQLAlchemy and the psycopg (v3) driver, or the local SQLite file"""
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        # Local development with SQLite
+        return 'sqlite:///library.db'
+    # Render uses postgres:// but SQLAlchemy needs postgresql://
+    if database_url.startswith('postgres://'):
+        return database_url.replace('postgres://', 'postgresql+psycopg://', 1)
+    if database_url.startswith('postgresql://'):
+        return database_url.replace('postgresql://', 'postgresql+psycopg://', 1)
+    return database_url
+
+
+def get_async_database_url():
+    """The same database for SQLAlchemy's async engine (aiosqlite or psycopg async)"""
+    database_url = get_database_url()
+    if database_url.startswith('sqlite:///'):
+        path = database_url[len('sqlite:///'):]
+        if path and not os.path.isabs(path):
+            # Flask-SQLAlchemy keeps relative SQLite files in the instance folder
+            path = os.path.join(BASE_DIR, 'instance', path)
+        return f'sqlite+aiosqlite:///{path}'
+    # The psycopg dialect switches to its async variant under create_async_engine
+    return database_url
+
 
 class Config:
     """Base configuration"""
@@ -16,14 +47,112 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///library.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Password hashing - existing hashes are upgraded on the next successful login
+    PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+    
+    # Login protection
+    LOGIN_HASH_WORKERS = 2  # Password hashes verified in parallel per process
+    LOGIN_HASH_QUEUE_LIMIT = 8  # Logins allowed to wait for a hash worker
+    LOGIN_HASH_TIMEOUT = 5  # Seconds a login waits for its hash before giving up
+    LOGIN_IP_BURST = 20  # Login attempts per client IP before throttling
+    LOGIN_IP_PER_MINUTE = 10
+    LOGIN_USER_BURST = 5  # Login attempts per username before throttling
+    LOGIN_USER_PER_MINUTE = 2
+    # Proxies in front of the app whose X-Forwarded-For is trusted for the client IP (0 = none)
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+    
     # Borrowing settings
     BORROW_PERIOD_DAYS = 14  # Default borrowing period in days
     FINE_PER_DAY = 10  # Fine amount per day in rupees
     MAX_BOOKS_PER_USER = 5  # Maximum books a user can borrow at once
     
+    # Holds (reservation queue)
+    HOLD_PICKUP_DAYS = 3  # Days a copy set aside for a hold waits before passing to the next patron
+    MAX_HOLDS_PER_USER = 5  # Waiting or ready holds a user may have at once
+    
+    # Notifications (see notification_worker.py)
+    NOTIFY_TRANSPORT = os.environ.get('NOTIFY_TRANSPORT', 'file')  # file or smtp
+    NOTIFY_FILE = os.path.join(BASE_DIR, 'instance', 'notifications.log')  # file transport only
+    SMTP_HOST = os.environ.get('SMTP_HOST', 'localhost')
+    SMTP_PORT = int(os.environ.get('SMTP_PORT', 1025))  # 1025 = local debugging server
+    SMTP_USERNAME = os.environ.get('SMTP_USERNAME')
+    SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+    SMTP_USE_TLS = os.environ.get('SMTP_USE_TLS') == '1'
+    SMTP_SENDER = os.environ.get('SMTP_SENDER', 'library@localhost')
+    OUTBOX_BATCH_SIZE = 100  # Messages claimed per pass
+    OUTBOX_CLAIM_SECONDS = 300  # A claimed message is not picked up again for this long
+    OUTBOX_MAX_ATTEMPTS = 6  # Give up on a message after this many failures
+    OUTBOX_RETRY_SECONDS = 60  # First retry delay; doubles after every failure
+    OUTBOX_POLL_SECONDS = 5  # Worker sleep when the outbox is empty
+    REMINDER_DUE_SOON_DAYS = 2  # Remind patrons this many days before the due date
+    REMINDER_OVERDUE_EVERY_DAYS = 7  # Repeat overdue reminders this often
+    REMINDER_INTERVAL_SECONDS = 3600  # How often the worker scans for reminders
+    
     # Book lost threshold
     LOST_BOOK_DAYS = 30  # Days after which an unreturned book is considered lost
     
+    # Archiving of returned borrow records
+    ARCHIVE_AFTER_DAYS = 365  # Returned records older than this move to the archive table
+    ARCHIVE_BATCH_SIZE = 1000  # Records moved per transaction
+    
+    # Circulation rollups
+    ROLLUP_SETTLE_SECONDS = 300  # Newest events left for the next run, in case they have not committed yet
+    
+    # "Also borrowed" recommendations
+    RECOMMENDATIONS_TOP_K = 10  # Neighbours stored per book
+    RECOMMENDATIONS_MAX_BASKET = 500  # Ignore patrons with more distinct books than this
+    RECOMMENDATIONS_CHUNK_SIZE = 100000  # Borrow events read per chunk during a rebuild
+    RECOMMENDATIONS_MAX_PAIRS = 5000000  # Book pairs expanded at once; bounds memory per chunk
+    
+    # Bulk admin operations
+    BULK_CHUNK_SIZE = 500  # Ids per IN (...) list in set-based statements
+    
+    # Rendered-fragment cache for catalog cards and record rows
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND', 'memory')  # memory, filesystem or none
+    FRAGMENT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    FRAGMENT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'libwise-fragments')  # filesystem backend only
+    
+    # SQLite profile (only used when the database is SQLite)
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', '1') == '1'
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,  # Milliseconds a writer waits for the lock
+        'cache_size': -20000,  # Negative = KiB, so about 20 MB per connection
+        'mmap_size': 134217728,  # 128 MB of memory-mapped reads
+        'temp_store': 'MEMORY',
+    }
+    SQLITE_MAINTENANCE_SECONDS = 600  # PRAGMA optimize and WAL checkpoint interval
+    
+    # Multi-branch mode (tenancy.py) - one app serving several branch databases
+    TENANTS_FILE = os.environ.get('TENANTS_FILE')  # JSON list of branches; unset = single library
+    TENANT_ROUTING = os.environ.get('TENANT_ROUTING', 'path')  # path (/<branch>/...) or host
+    TENANT_MAX_ENGINES = 16  # Branch engines kept open per worker; idle ones beyond this are closed
+    TENANT_POOL_SIZE = 2  # Connections kept per branch engine
+    TENANT_MAX_OVERFLOW = 3
+    TENANT = os.environ.get('TENANT')  # Branch used by maintenance scripts
+    
+    # Catalog availability index (availability_index.py)
+    AVAILABILITY_INDEX_MAX_AGE = 60  # Seconds before the index re-reads changed rows even without a bump
+    AVAILABILITY_INDEX_OVERLAP = 30  # Seconds of changes re-read before the newest one seen, for late commits
+    
+    # Cross-worker cache invalidation
+    CACHE_VERSION_CHECK_INTERVAL = 2  # Seconds between reads of cache_versions (0 = every request)
+    
+    # Compiled templates shared by all workers (fill with precompile_templates.py; empty = off)
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR',
+                                              os.path.join(BASE_DIR, 'instance', 'jinja_cache'))
+    
+    # Response compression (gzip, or brotli when installed)
+    COMPRESS_MIN_SIZE = 1024  # Smaller bodies are sent as they are
+    COMPRESS_LEVEL = 6
+    
+    # Async API tier (async_api.py)
+    API_DB_POOL_SIZE = 10  # Connections per event-loop worker
+    API_DB_MAX_OVERFLOW = 20
+    API_LONG_POLL_SECONDS = 30  # Longest a client may wait on /availability
+    API_POLL_INTERVAL = 1  # Seconds between a worker's database checks for all waiting clients
+    
     # Pagination
     BOOKS_PER_PAGE = 12
     RECORDS_PER_PAGE = 20
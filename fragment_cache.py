@@ -0,0 +1,177 @@
+"""
+Jinja fragment cache for template snippets that rarely change.
+
+    {% cache 'book-card', book.id, book.updated_at %}
+        ... expensive markup ...
+    {% endcache %}
+
+The key parts should include a version stamp of every row the fragment
+shows (e.g. its updated_at), so an edited row simply gets a new key and the
+stale entry ages out of the cache.
+
+Set environment.fragment_cache_key_prefix to a function returning a prefix
+for every key, e.g. the current branch when several databases share a cache.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+class MemoryBackend:
+    """Per-process LRU cache bounded by the total size of the cached fragments"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class FileSystemBackend:
+    """Cache directory shared by every worker process on the host.
+
+    Reads refresh a file's modification time, and once the directory grows
+    past max_bytes the least recently used files are removed.
+    """
+
+    # Check the directory size after this many writes
+    PRUNE_INTERVAL = 200
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as fragment:
+                value = fragment.read()
+            os.utime(path)
+            return value
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        # Write then rename so other workers never read a half-written file
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'w', encoding='utf-8') as fragment:
+            fragment.write(value)
+        os.replace(temp_path, path)
+
+        self._writes += 1
+        if self._writes % self.PRUNE_INTERVAL == 0:
+            self._prune()
+
+    def _prune(self):
+        files = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+        # Trim to 80% so we do not prune again on the very next write
+        for _, size, path in sorted(files):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes * 0.8:
+                break
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def create_fragment_cache(backend, max_bytes, directory=None):
+    """Build the backend named in the config, or None when caching is disabled"""
+    if backend == 'memory':
+        return MemoryBackend(max_bytes)
+    if backend == 'filesystem':
+        return FileSystemBackend(directory, max_bytes)
+    return None
+
+
+class FragmentCacheExtension(Extension):
+    """Adds the {% cache key, ... %}...{% endcache %} tag"""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None, fragment_cache_key_prefix=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render', [nodes.List(key_parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, key_parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        key_prefix = self.environment.fragment_cache_key_prefix
+        if key_prefix is not None:
+            key_parts = [key_prefix()] + list(key_parts)
+        key = '|'.join(str(part) for part in key_parts)
+        value = cache.get(key)
+        if value is None:
+            value = str(caller())
+            cache.set(key, value)
+        return Markup(value)
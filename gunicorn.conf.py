@@ -0,0 +1,32 @@
+"""
+Gunicorn settings for LibWise.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The master imports the app once (preload_app) and calls app.warm_up() before
+forking, so every worker starts with the app imported, templates loaded and
+the catalog, category and statistics caches filled, all shared
+copy-on-write. Set GUNICORN_PRELOAD=0 to import the app in each worker
+instead, e.g. to pick up new code on a HUP without restarting the master.
+"""
+
+import gc
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:' + os.environ.get('PORT', '5000'))
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+
+    from app import warm_up
+
+    warm_up()
+    # Move everything loaded so far out of the collector's reach, so collections
+    # in the workers do not write to (and so copy) the shared pages
+    gc.collect()
+    gc.freeze()
+    server.log.info("Warmed up the app before forking workers")
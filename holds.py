@@ -0,0 +1,127 @@
+"""
+Reservation queue for books with no copies on the shelf.
+
+Holds are served first come, first served. A returned copy goes to the
+oldest waiting hold in the same transaction as the return and stays off the
+shelf (available_copies is not increased) until that patron borrows it or
+the pickup window closes, when it passes to the next hold in line.
+
+Run from cron to expire uncollected holds:
+
+    python holds.py
+"""
+
+from datetime import datetime, timedelta
+
+from cache_bus import bump, BOOKS
+from config import Config
+from models import db, Hold
+from notifications import notify_hold_ready
+
+ACTIVE_STATUSES = ('waiting', 'ready')
+
+
+def allocate_copy(book, now=None):
+    """Give a copy coming back to book to the next waiting hold, or return it to the shelf.
+
+    Returns the hold the copy was set aside for, or None.
+    """
+    now = now or datetime.utcnow()
+    hold = Hold.query.filter_by(book_id=book.id, status='waiting').order_by(
+        Hold.created_at, Hold.id
+    ).with_for_update(skip_locked=True).first()
+
+    if hold is None:
+        book.return_book()
+        return None
+
+    hold.status = 'ready'
+    hold.ready_at = now
+    hold.expires_at = now + timedelta(days=Config.HOLD_PICKUP_DAYS)
+    notify_hold_ready(hold, book)
+    return hold
+
+
+def withdraw_hold(hold, status):
+    """Close an active hold as cancelled or expired, passing on a copy set aside for it"""
+    was_ready = hold.status == 'ready'
+    hold.status = status
+    if was_ready:
+        allocate_copy(hold.book)
+        bump(BOOKS)
+
+
+def get_active_holds(user_id, book_ids):
+    """Waiting or ready holds of one user for any of book_ids, keyed by book id.
+
+    Whoever borrows a book fulfils their own hold on it, whether a copy was
+    set aside for it yet or not, so it never claims a copy later.
+    """
+    if not book_ids:
+        return {}
+    return {
+        hold.book_id: hold
+        for hold in Hold.query.filter(
+            Hold.user_id == user_id,
+            Hold.book_id.in_(book_ids),
+            Hold.status.in_(ACTIVE_STATUSES)
+        )
+    }
+
+
+def queue_position(hold):
+    """1-based place of a waiting hold in its book's queue (one indexed count)"""
+    ahead = Hold.query.filter(
+        Hold.book_id == hold.book_id,
+        Hold.status == 'waiting',
+        db.or_(
+            Hold.created_at < hold.created_at,
+            db.and_(Hold.created_at == hold.created_at, Hold.id < hold.id)
+        )
+    ).count()
+    return ahead + 1
+
+
+def release_user_holds(user_ids):
+    """Cancel the holds of users that are about to be deleted and pass on their copies.
+
+    Every hold of those users is cancelled before any copy is passed on, so a
+    copy never goes to another hold that is about to be deleted with them.
+    """
+    holds = Hold.query.filter(
+        Hold.user_id.in_(user_ids),
+        Hold.status.in_(ACTIVE_STATUSES)
+    ).all()
+    freed = [hold.book for hold in holds if hold.status == 'ready']
+
+    for hold in holds:
+        hold.status = 'cancelled'
+    # allocate_copy() only looks at waiting holds, which now excludes these users'
+    db.session.flush()
+
+    for book in freed:
+        allocate_copy(book)
+    if freed:
+        bump(BOOKS)
+
+
+def expire_holds(now=None):
+    """Expire ready holds past their pickup deadline; returns how many expired"""
+    now = now or datetime.utcnow()
+    expired = Hold.query.filter(
+        Hold.status == 'ready',
+        Hold.expires_at < now
+    ).order_by(Hold.expires_at).all()
+
+    for hold in expired:
+        withdraw_hold(hold, 'expired')
+    db.session.commit()
+    return len(expired)
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        count = expire_holds()
+        print(f"Expired {count} uncollected holds.")
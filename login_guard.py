@@ -0,0 +1,107 @@
+"""
+Keeps password hashing from starving the rest of the app.
+
+Logins are throttled per username and per client IP with token buckets
+before any hash runs, and every hash (login, rehash, signup) runs on a small
+bounded thread pool. When the pool and its queue are full the login is refused straight
+away instead of tying up another request worker.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import lru_cache
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashPoolBusy(Exception):
+    """Raised when no password-hash slot is free"""
+
+
+class LoginThrottle:
+    """Token buckets keyed by username or IP address.
+
+    Each key holds up to `capacity` tokens and regains `per_minute` tokens per
+    minute. Only the `max_keys` most recently seen keys are remembered.
+    """
+
+    def __init__(self, capacity, per_minute, max_keys=10000):
+        self.capacity = capacity
+        self.refill_per_second = per_minute / 60.0
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """Take one token for key; return False when the bucket is empty"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def reset(self, key):
+        """Forget key, e.g. after a successful login"""
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+class PasswordHashPool:
+    """Compute and verify password hashes on a bounded thread pool"""
+
+    def __init__(self, workers, queue_limit, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so that every gunicorn worker gets its own threads after fork
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix='password-hash'
+                    )
+        return self._executor
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashPoolBusy()
+
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashPoolBusy()
+
+    def verify(self, password_hash, password):
+        """Return whether password matches; raise HashPoolBusy if the pool is saturated"""
+        return self._run(check_password_hash, password_hash, password)
+
+    def hash(self, password, method):
+        """Return a new hash of password; raise HashPoolBusy if the pool is saturated"""
+        return self._run(generate_password_hash, password, method)
+
+
+@lru_cache(maxsize=None)
+def hash_method_prefix(method):
+    """The parameter prefix Werkzeug writes for method, e.g. 'scrypt:32768:8:1'"""
+    return generate_password_hash('', method=method).split('$', 1)[0]
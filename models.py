@@ -1,8 +1,23 @@
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from datetime import datetime
+import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
+from config import Config
+from login_guard import hash_method_prefix
+from tenancy import TenantSQLAlchemy
 
-db = SQLAlchemy()
+# Plain Flask-SQLAlchemy unless multi-branch mode is on (see tenancy.py)
+db = TenantSQLAlchemy()
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite only honours ON DELETE rules when foreign keys are switched on per connection"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -11,20 +26,30 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     full_name = db.Column(db.String(120), nullable=False)
+    email = db.Column(db.String(120))  # Optional; needed for email notifications
     is_admin = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Relationships
-    borrow_records = db.relationship('BorrowRecord', backref='user', lazy=True, cascade='all, delete-orphan')
+    # Relationships - rows are removed by ON DELETE CASCADE, not loaded and deleted one by one
+    borrow_records = db.relationship('BorrowRecord', backref='user', lazy=True,
+                                     cascade='all, delete-orphan', passive_deletes=True)
+    archived_records = db.relationship('ArchivedBorrowRecord', backref='user', lazy=True,
+                                       cascade='all, delete-orphan', passive_deletes=True)
+    holds = db.relationship('Hold', backref='user', lazy=True,
+                            cascade='all, delete-orphan', passive_deletes=True)
     
     def set_password(self, password):
         """Hash and set password"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=Config.PASSWORD_HASH_METHOD)
     
     def check_password(self, password):
         """Check if provided password matches hash"""
         return check_password_hash(self.password_hash, password)
     
+    def needs_rehash(self):
+        """Check if the stored hash was made with different hashing parameters"""
+        return self.password_hash.split('$', 1)[0] != hash_method_prefix(Config.PASSWORD_HASH_METHOD)
+    
     def get_active_borrows(self):
         """Get count of active borrowed books"""
         return BorrowRecord.query.filter_by(
@@ -43,6 +68,9 @@ class User(db.Model):
 
 class Book(db.Model):
     __tablename__ = 'books'
+    __table_args__ = (
+        db.Index('ix_books_updated_at', 'updated_at'),  # Change scans by the availability index
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -55,9 +83,15 @@ class Book(db.Model):
     total_copies = db.Column(db.Integer, default=1, nullable=False)
     available_copies = db.Column(db.Integer, default=1, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Row version stamp
     
-    # Relationships
-    borrow_records = db.relationship('BorrowRecord', backref='book', lazy=True, cascade='all, delete-orphan')
+    # Relationships - rows are removed by ON DELETE CASCADE, not loaded and deleted one by one
+    borrow_records = db.relationship('BorrowRecord', backref='book', lazy=True,
+                                     cascade='all, delete-orphan', passive_deletes=True)
+    archived_records = db.relationship('ArchivedBorrowRecord', backref='book', lazy=True,
+                                       cascade='all, delete-orphan', passive_deletes=True)
+    holds = db.relationship('Hold', backref='book', lazy=True,
+                            cascade='all, delete-orphan', passive_deletes=True)
     
     def is_available(self):
         """Check if book has available copies"""
@@ -83,15 +117,21 @@ class Book(db.Model):
 
 class BorrowRecord(db.Model):
     __tablename__ = 'borrow_records'
+    __table_args__ = (
+        db.Index('ix_borrow_records_user_status', 'user_id', 'status'),
+        db.Index('ix_borrow_records_book_status', 'book_id', 'status'),
+        db.Index('ix_borrow_records_status_return_date', 'status', 'return_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
-    borrow_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    due_date = db.Column(db.DateTime, nullable=False)
-    return_date = db.Column(db.DateTime)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
+    borrow_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    due_date = db.Column(db.DateTime, nullable=False, index=True)
+    return_date = db.Column(db.DateTime, index=True)
     status = db.Column(db.String(20), default='borrowed')  # borrowed, returned, overdue
     fine_amount = db.Column(db.Float, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Row version stamp
     
     def calculate_fine(self, fine_per_day=10):
         """Calculate fine based on overdue days"""
@@ -122,3 +162,125 @@ class BorrowRecord(db.Model):
     
     def __repr__(self):
         return f'<BorrowRecord {self.id}>'
+
+
+class Hold(db.Model):
+    """A patron's place in the queue for a book with no copies on the shelf"""
+    __tablename__ = 'holds'
+    __table_args__ = (
+        db.Index('ix_holds_book_status_created', 'book_id', 'status', 'created_at'),
+        db.Index('ix_holds_user_status', 'user_id', 'status'),
+        db.Index('ix_holds_status_expires', 'status', 'expires_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(db.String(20), default='waiting', nullable=False)  # waiting, ready, fulfilled, cancelled, expired
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # Queue order
+    ready_at = db.Column(db.DateTime)  # When a returned copy was set aside for this hold
+    expires_at = db.Column(db.DateTime)  # Pickup deadline once ready
+    
+    def __repr__(self):
+        return f'<Hold {self.id} book={self.book_id} {self.status}>'
+
+
+class ArchivedBorrowRecord(db.Model):
+    """Returned borrow records moved out of the hot borrow_records table"""
+    __tablename__ = 'borrow_records_archive'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # borrow_records reuses the ids of deleted rows, so the original id is not a key here
+    original_id = db.Column(db.Integer, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), nullable=False, index=True)
+    borrow_date = db.Column(db.DateTime, nullable=False)
+    due_date = db.Column(db.DateTime, nullable=False)
+    return_date = db.Column(db.DateTime)
+    status = db.Column(db.String(20), default='returned')
+    fine_amount = db.Column(db.Float, default=0.0)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<ArchivedBorrowRecord {self.id}>'
+
+
+class CirculationRollup(db.Model):
+    """Daily circulation counts per book, maintained by circulation_rollups.py"""
+    __tablename__ = 'circulation_daily'
+    __table_args__ = (
+        db.Index('ix_circulation_daily_book_day', 'book_id', 'day'),
+        db.Index('ix_circulation_daily_category_day', 'category', 'day'),
+    )
+    
+    day = db.Column(db.Date, primary_key=True)
+    # No foreign key: trends must survive the book being deleted
+    book_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    category = db.Column(db.String(50))
+    borrows = db.Column(db.Integer, default=0, nullable=False)
+    returns = db.Column(db.Integer, default=0, nullable=False)
+    overdues = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<CirculationRollup {self.day} book={self.book_id}>'
+
+
+class BookRecommendation(db.Model):
+    """Top co-borrowed books for each book, rebuilt offline by recommendations.py"""
+    __tablename__ = 'book_recommendations'
+    
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)  # 0 = strongest
+    recommended_book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Integer, nullable=False)  # Patrons who borrowed both books
+    
+    def __repr__(self):
+        return f'<BookRecommendation {self.book_id} -> {self.recommended_book_id}>'
+
+
+class JobWatermark(db.Model):
+    """Point up to which an incremental background job has processed events"""
+    __tablename__ = 'job_watermarks'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<JobWatermark {self.name}={self.value}>'
+
+
+class CacheVersion(db.Model):
+    """Version counter per kind of cached data, bumped in the same transaction as the write"""
+    __tablename__ = 'cache_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
+
+
+class OutboxMessage(db.Model):
+    """Notification written in the same transaction as the event; sent by notification_worker.py"""
+    __tablename__ = 'notification_outbox'
+    __table_args__ = (
+        db.Index('ix_notification_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    kind = db.Column(db.String(30), nullable=False)  # borrowed, returned, hold_ready, due_soon, overdue
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    dedupe_key = db.Column(db.String(100), unique=True)  # Stops a reminder being queued twice
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, sent, failed, skipped
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime)
+    
+    user = db.relationship('User')
+    
+    def __repr__(self):
+        return f'<OutboxMessage {self.id} {self.kind} {self.status}>'
@@ -0,0 +1,227 @@
+"""
+Month-end fine and circulation report.
+
+Borrow records (including the archive) are streamed from the database in
+column chunks and every metric is computed with NumPy array operations, so a
+month with millions of records does not build millions of ORM objects.
+
+    python monthly_report.py 2025-10
+    python monthly_report.py 2025-10 --format json --output october.json
+"""
+
+import argparse
+import csv
+import json
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from config import Config
+from models import db, Book, BorrowRecord, ArchivedBorrowRecord
+
+SECONDS_PER_DAY = 86400
+EPOCH = datetime(1970, 1, 1)
+NEVER = np.inf  # Stand-in for a missing return date
+
+REPORT_FIELDS = [
+    'category', 'copies', 'loans', 'loan_days', 'utilization',
+    'fines_accrued', 'fines_collected', 'lost_books'
+]
+
+
+def _to_seconds(values):
+    """Convert a sequence of naive UTC datetimes (or None) to epoch seconds, None -> NEVER"""
+    moments = np.array(values, dtype='datetime64[s]')
+    seconds = moments.astype(np.int64).astype(float)
+    seconds[np.isnat(moments)] = NEVER
+    return seconds
+
+
+def _stream_chunks(model, month_start, month_end, chunk_size):
+    """Yield column arrays for records that were out at some point during the month"""
+    query = db.select(
+        model.book_id,
+        model.borrow_date,
+        model.due_date,
+        model.return_date,
+        model.fine_amount
+    ).where(
+        model.borrow_date < month_end,
+        db.or_(model.return_date.is_(None), model.return_date >= month_start)
+    ).execution_options(yield_per=chunk_size)
+
+    for rows in db.session.execute(query).partitions():
+        book_ids, borrow_dates, due_dates, return_dates, fines = zip(*rows)
+        yield (
+            np.fromiter(book_ids, dtype=np.int64, count=len(rows)),
+            _to_seconds(borrow_dates),
+            _to_seconds(due_dates),
+            _to_seconds(return_dates),
+            np.nan_to_num(np.array(fines, dtype=float))
+        )
+
+
+def _load_categories():
+    """Return sorted book ids, each book's category index and the category names"""
+    rows = db.session.query(Book.id, Book.category, Book.total_copies).order_by(Book.id).all()
+    names = sorted({category or 'General' for _, category, _ in rows})
+    # The last slot collects records whose book no longer exists
+    names.append('Unknown')
+    index = {name: position for position, name in enumerate(names)}
+
+    book_ids = np.array([book_id for book_id, _, _ in rows], dtype=np.int64)
+    book_categories = np.array([index[category or 'General'] for _, category, _ in rows], dtype=np.int64)
+    copies = np.bincount(
+        book_categories,
+        weights=np.array([total for _, _, total in rows], dtype=float),
+        minlength=len(names)
+    )
+    return book_ids, book_categories, names, copies
+
+
+def _fine_at(moment, due, returned, fine_per_day):
+    """Fine owed at `moment`, in whole overdue days like BorrowRecord.calculate_fine()"""
+    end = np.minimum(returned, moment)
+    overdue_days = np.maximum(end - due, 0) // SECONDS_PER_DAY
+    return overdue_days * fine_per_day
+
+
+def generate_monthly_report(year, month, chunk_size=50000, now=None):
+    """Compute the month's fines, lost books and per-category utilization.
+
+    A month still in progress is reported up to now; a month that has not
+    started yet raises ValueError.
+    """
+    month_start = datetime(year, month, 1)
+    month_end = datetime(year + month // 12, month % 12 + 1, 1)
+    now = now or datetime.utcnow()
+    if now < month_start:
+        raise ValueError(f'{year:04d}-{month:02d} has not started yet')
+    as_of = min(month_end, now)
+
+    start_s = (month_start - EPOCH).total_seconds()
+    end_s = (month_end - EPOCH).total_seconds()
+    as_of_s = (as_of - EPOCH).total_seconds()
+    lost_after_s = Config.LOST_BOOK_DAYS * SECONDS_PER_DAY
+    fine_per_day = Config.FINE_PER_DAY
+    days_in_month = (end_s - start_s) / SECONDS_PER_DAY
+
+    book_ids, book_categories, names, copies = _load_categories()
+    unknown = len(names) - 1
+    totals = {field: np.zeros(len(names)) for field in REPORT_FIELDS[2:] if field != 'utilization'}
+
+    for model in (BorrowRecord, ArchivedBorrowRecord):
+        for book_id, borrowed, due, returned, fine_amount in _stream_chunks(model, month_start, month_end, chunk_size):
+            # Map every record to its book's category with one binary search
+            position = np.searchsorted(book_ids, book_id)
+            position = np.minimum(position, max(len(book_ids) - 1, 0))
+            if len(book_ids):
+                found = book_ids[position] == book_id
+                category = np.where(found, book_categories[position], unknown)
+            else:
+                category = np.full(len(book_id), unknown)
+
+            def add(field, values):
+                totals[field] += np.bincount(category, weights=values, minlength=len(names))
+
+            # Time each copy spent out during the month
+            out_from = np.maximum(borrowed, start_s)
+            out_until = np.minimum(returned, as_of_s)
+            loan_days = np.maximum(out_until - out_from, 0) / SECONDS_PER_DAY
+            add('loans', ((borrowed >= start_s) & (borrowed < end_s)).astype(float))
+            add('loan_days', loan_days)
+
+            # Fines accrued = growth of the outstanding fine over the month
+            accrued = _fine_at(as_of_s, due, returned, fine_per_day) - _fine_at(start_s, due, returned, fine_per_day)
+            add('fines_accrued', accrued)
+
+            returned_in_month = (returned >= start_s) & (returned < end_s)
+            add('fines_collected', np.where(returned_in_month, fine_amount, 0.0))
+
+            still_out = returned >= as_of_s
+            add('lost_books', (still_out & (as_of_s - due > lost_after_s)).astype(float))
+
+    rows = []
+    for position, name in enumerate(names):
+        if position == unknown and not totals['loans'][position] and not totals['loan_days'][position]:
+            continue
+        capacity = copies[position] * days_in_month
+        rows.append({
+            'category': name,
+            'copies': int(copies[position]),
+            'loans': int(totals['loans'][position]),
+            'loan_days': round(float(totals['loan_days'][position]), 2),
+            'utilization': round(float(totals['loan_days'][position] / capacity), 4) if capacity else 0.0,
+            'fines_accrued': round(float(totals['fines_accrued'][position]), 2),
+            'fines_collected': round(float(totals['fines_collected'][position]), 2),
+            'lost_books': int(totals['lost_books'][position])
+        })
+
+    all_capacity = copies.sum() * days_in_month
+    summary = {
+        'category': 'ALL',
+        'copies': int(copies.sum()),
+        'loans': int(totals['loans'].sum()),
+        'loan_days': round(float(totals['loan_days'].sum()), 2),
+        'utilization': round(float(totals['loan_days'].sum() / all_capacity), 4) if all_capacity else 0.0,
+        'fines_accrued': round(float(totals['fines_accrued'].sum()), 2),
+        'fines_collected': round(float(totals['fines_collected'].sum()), 2),
+        'lost_books': int(totals['lost_books'].sum())
+    }
+
+    return {
+        'month': f'{year:04d}-{month:02d}',
+        'as_of': as_of.isoformat(timespec='seconds'),
+        'totals': summary,
+        'categories': rows
+    }
+
+
+def write_report(report, output, output_format='csv'):
+    """Write the report as CSV (one row per category plus ALL) or JSON"""
+    if output_format == 'json':
+        json.dump(report, output, indent=2)
+        output.write('\n')
+        return
+
+    writer = csv.DictWriter(output, fieldnames=REPORT_FIELDS)
+    writer.writeheader()
+    writer.writerows(report['categories'])
+    writer.writerow(report['totals'])
+
+
+def _year_month(value):
+    """argparse type for YYYY-MM; returns (year, month)"""
+    try:
+        parsed = datetime.strptime(value, '%Y-%m')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid month {value!r}, expected YYYY-MM (e.g. 2024-03)")
+    return parsed.year, parsed.month
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the month-end fine and circulation report')
+    parser.add_argument('month', type=_year_month, help='month to report on (YYYY-MM)')
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+    parser.add_argument('--output', help='file to write (default: stdout)')
+    parser.add_argument('--chunk-size', type=int, default=50000,
+                        help='records fetched from the database per chunk')
+    args = parser.parse_args()
+
+    year, month = args.month
+
+    from app import app
+
+    with app.app_context():
+        try:
+            report = generate_monthly_report(year, month, args.chunk_size)
+        except ValueError as error:
+            parser.error(str(error))
+
+    if args.output:
+        with open(args.output, 'w', newline='') as output:
+            write_report(report, output, args.format)
+        print(f"Report written to {args.output}")
+    else:
+        write_report(report, sys.stdout, args.format)
@@ -0,0 +1,334 @@
+"""
+Background worker that sends patron notifications from the outbox.
+
+Pending messages are claimed in batches and sent through the configured
+transport, each outcome committed right after its send. Failed messages are retried with exponential backoff and given up on after
+OUTBOX_MAX_ATTEMPTS. The worker also queues due-soon and overdue reminders
+from range scans on the indexed due_date column; dedupe keys make repeated
+scans harmless.
+
+    python notification_worker.py           # run forever
+    python notification_worker.py --once    # one pass, e.g. from cron
+
+The `file` transport appends messages to NOTIFY_FILE. For SMTP, a local
+debugging server works as a stand-in: python -m aiosmtpd -n -l localhost:1025
+"""
+
+import argparse
+import json
+import logging
+import smtplib
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from config import Config
+from models import db, BorrowRecord, OutboxMessage
+from notifications import notify_due_soon, notify_overdue
+from sqlite_profile import write_transaction
+
+SCAN_CHUNK_SIZE = 500
+
+# Columns of a reminder copied into its INSERT
+MESSAGE_COLUMNS = ('user_id', 'kind', 'subject', 'body', 'dedupe_key')
+
+logger = logging.getLogger(__name__)
+
+# message id -> column values of messages whose outcome could not be committed yet
+_unsaved_outcomes = {}
+
+
+class NoAddress(Exception):
+    """The patron has no address for this transport; the message is skipped"""
+
+
+class TransportUnavailable(Exception):
+    """The transport cannot send anything right now; the batch is retried later"""
+
+
+class FileTransport:
+    """Appends each message as a JSON line to a local file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, message):
+        with open(self.path, 'a', encoding='utf-8') as log:
+            log.write(json.dumps({
+                'id': message.id,
+                'to': message.user.email or message.user.username,
+                'kind': message.kind,
+                'subject': message.subject,
+                'body': message.body,
+                'sent_at': datetime.utcnow().isoformat()
+            }, ensure_ascii=False) + '\n')
+
+    def close(self):
+        pass
+
+
+class SmtpTransport:
+    """Sends email over one SMTP connection per batch"""
+
+    def __init__(self, host, port, sender, username=None, password=None, use_tls=False):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self._smtp = None
+
+    def _connect(self):
+        try:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except (OSError, smtplib.SMTPException) as e:
+            raise TransportUnavailable(str(e))
+        return smtp
+
+    def send(self, message):
+        if not message.user.email:
+            raise NoAddress()
+
+        email = EmailMessage()
+        email['From'] = self.sender
+        email['To'] = message.user.email
+        email['Subject'] = message.subject
+        email.set_content(message.body)
+
+        if self._smtp is None:
+            self._smtp = self._connect()
+        try:
+            self._smtp.send_message(email)
+        except smtplib.SMTPServerDisconnected as e:
+            self._smtp = None
+            raise TransportUnavailable(str(e))
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            self._smtp = None
+
+
+def create_transport(name=None):
+    name = name or Config.NOTIFY_TRANSPORT
+    if name == 'file':
+        return FileTransport(Config.NOTIFY_FILE)
+    if name == 'smtp':
+        return SmtpTransport(Config.SMTP_HOST, Config.SMTP_PORT, Config.SMTP_SENDER,
+                             Config.SMTP_USERNAME, Config.SMTP_PASSWORD, Config.SMTP_USE_TLS)
+    raise ValueError(f'Unknown notification transport: {name}')
+
+
+def _claim(batch_size, now):
+    """Lease up to batch_size due messages to this worker in one short write transaction.
+
+    A claimed message stays pending but is not due again for
+    OUTBOX_CLAIM_SECONDS, so no other pass picks it up while it is being sent.
+    """
+    with write_transaction(db.session):
+        # skip_locked lets several workers claim from the same outbox on PostgreSQL
+        messages = OutboxMessage.query.filter(
+            OutboxMessage.status == 'pending',
+            OutboxMessage.next_attempt_at <= now,
+            OutboxMessage.id.notin_(list(_unsaved_outcomes))
+        ).order_by(OutboxMessage.next_attempt_at, OutboxMessage.id).limit(
+            batch_size
+        ).with_for_update(skip_locked=True).all()
+        for message in messages:
+            message.next_attempt_at = now + timedelta(seconds=Config.OUTBOX_CLAIM_SECONDS)
+        db.session.commit()
+    return messages
+
+
+def _save_outcome(message_id, values):
+    """Store what happened to a message in its own short write transaction.
+
+    If the commit fails (e.g. the database stayed locked), the outcome is kept
+    in memory and saved before anything else is sent on a later pass; the claim
+    keeps the message from being sent again meanwhile. Returns whether it was saved.
+    """
+    _unsaved_outcomes[message_id] = values
+    try:
+        with write_transaction(db.session):
+            db.session.execute(
+                db.update(OutboxMessage).where(OutboxMessage.id == message_id).values(**values)
+            )
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning('Could not save the outcome of message %s: %s', message_id, e)
+        return False
+    del _unsaved_outcomes[message_id]
+    return True
+
+
+def drain_outbox(transport, batch_size=None):
+    """Send one batch of due messages; returns (sent, failed) counts.
+
+    Each outcome is committed right after its send, so neither a SQLite write
+    lock nor PostgreSQL row locks are held while the transport is slow.
+    """
+    batch_size = batch_size or Config.OUTBOX_BATCH_SIZE
+
+    for message_id, values in list(_unsaved_outcomes.items()):
+        if not _save_outcome(message_id, values):
+            return 0, 0  # Still cannot write; send nothing more until it can
+
+    now = datetime.utcnow()
+    messages = _claim(batch_size, now)
+
+    sent = failed = 0
+    for position, message in enumerate(messages):
+        try:
+            transport.send(message)
+        except NoAddress:
+            _save_outcome(message.id, {'status': 'skipped'})
+            continue
+        except TransportUnavailable as e:
+            # Not the message's fault: hand this and the rest back for the next pass
+            print(f"Transport unavailable: {e}")
+            for unsent in messages[position:]:
+                _save_outcome(unsent.id, {'next_attempt_at': now})
+            break
+        except Exception as e:
+            attempts = message.attempts + 1
+            values = {'attempts': attempts, 'last_error': str(e)[:1000]}
+            if attempts >= Config.OUTBOX_MAX_ATTEMPTS:
+                values['status'] = 'failed'
+            else:
+                delay = Config.OUTBOX_RETRY_SECONDS * 2 ** (attempts - 1)
+                values['next_attempt_at'] = now + timedelta(seconds=delay)
+            _save_outcome(message.id, values)
+            failed += 1
+            continue
+
+        _save_outcome(message.id, {'status': 'sent', 'sent_at': datetime.utcnow()})
+        sent += 1
+
+    return sent, failed
+
+
+def _insert_new_messages(rows):
+    """Insert outbox rows whose dedupe_key is not queued yet; returns how many were inserted"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    if insert is not None:
+        # Also safe when two workers scan at the same time: the loser's rows are skipped
+        return db.session.execute(
+            insert(OutboxMessage.__table__).on_conflict_do_nothing(index_elements=['dedupe_key']),
+            rows
+        ).rowcount
+
+    existing = {
+        key for (key,) in db.session.query(OutboxMessage.dedupe_key).filter(
+            OutboxMessage.dedupe_key.in_([row['dedupe_key'] for row in rows])
+        )
+    }
+    rows = [row for row in rows if row['dedupe_key'] not in existing]
+    if rows:
+        db.session.execute(db.insert(OutboxMessage.__table__), rows)
+    return len(rows)
+
+
+def _queue_new(records, notify):
+    """Queue notify's message for records whose reminder is not in the outbox yet"""
+    queued = 0
+    for start in range(0, len(records), SCAN_CHUNK_SIZE):
+        messages = [notify(record) for record in records[start:start + SCAN_CHUNK_SIZE]]
+        rows = []
+        for message in messages:
+            # Inserted below with the duplicates skipped, not through the session
+            db.session.expunge(message)
+            rows.append({column: getattr(message, column) for column in MESSAGE_COLUMNS})
+        if rows:
+            queued += _insert_new_messages(rows)
+    return queued
+
+
+def queue_reminders(now=None):
+    """Queue due-soon and overdue reminders; returns how many were queued"""
+    now = now or datetime.utcnow()
+
+    with db.session.no_autoflush:
+        due_soon = BorrowRecord.query.filter(
+            BorrowRecord.due_date >= now,
+            BorrowRecord.due_date < now + timedelta(days=Config.REMINDER_DUE_SOON_DAYS),
+            BorrowRecord.status == 'borrowed'
+        ).options(db.joinedload(BorrowRecord.book)).all()
+
+        # Stop reminding once the book counts as lost
+        overdue = BorrowRecord.query.filter(
+            BorrowRecord.due_date < now,
+            BorrowRecord.due_date >= now - timedelta(days=Config.LOST_BOOK_DAYS),
+            BorrowRecord.status.in_(['borrowed', 'overdue'])
+        ).options(db.joinedload(BorrowRecord.book)).all()
+
+        queued = _queue_new(due_soon, notify_due_soon)
+        queued += _queue_new(overdue, lambda record: notify_overdue(record, now))
+
+    db.session.commit()
+    return queued
+
+
+def _run_pass(transport, scan):
+    if scan:
+        queued = queue_reminders()
+        if queued:
+            print(f"Queued {queued} reminders.")
+
+    while True:
+        sent, failed = drain_outbox(transport)
+        if sent or failed:
+            print(f"Sent {sent} notifications, {failed} failed.")
+        if sent + failed < Config.OUTBOX_BATCH_SIZE:
+            break
+
+
+def run(transport, once=False):
+    last_scan = None
+    try:
+        while True:
+            scan = last_scan is None or time.monotonic() - last_scan >= Config.REMINDER_INTERVAL_SECONDS
+            try:
+                _run_pass(transport, scan)
+            except Exception:
+                # e.g. the database was locked or restarted: start clean on the next pass
+                db.session.rollback()
+                if once:
+                    raise
+                logger.exception('Notification pass failed')
+            else:
+                if scan:
+                    last_scan = time.monotonic()
+
+            if once:
+                return
+            time.sleep(Config.OUTBOX_POLL_SECONDS)
+    finally:
+        transport.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Send patron notifications from the outbox')
+    parser.add_argument('--once', action='store_true', help='do one pass and exit')
+    parser.add_argument('--transport', choices=['file', 'smtp'], default=Config.NOTIFY_TRANSPORT)
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        run(create_transport(args.transport), once=args.once)
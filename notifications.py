@@ -0,0 +1,58 @@
+"""
+Patron notifications written to the transactional outbox.
+
+The helpers below only add an OutboxMessage to the current session, so the
+notification is committed together with the borrow, return or hold that
+caused it and nothing slow happens inside the request. notification_worker.py
+sends the messages.
+"""
+
+from config import Config
+from models import db, OutboxMessage
+
+
+def enqueue(user_id, kind, subject, body, dedupe_key=None):
+    """Add a message to the outbox as part of the current transaction"""
+    message = OutboxMessage(
+        user_id=user_id,
+        kind=kind,
+        subject=subject,
+        body=body,
+        dedupe_key=dedupe_key
+    )
+    db.session.add(message)
+    return message
+
+
+def notify_borrowed(user_id, book, due_date):
+    return enqueue(user_id, 'borrowed', f'You borrowed "{book.title}"',
+            f'"{book.title}" by {book.author} is due back on {due_date:%Y-%m-%d}.')
+
+
+def notify_returned(record, book):
+    fine = f' A fine of ₹{record.fine_amount:.0f} was charged.' if record.fine_amount else ''
+    return enqueue(record.user_id, 'returned', f'You returned "{book.title}"',
+            f'Thank you for returning "{book.title}".{fine}')
+
+
+def notify_hold_ready(hold, book):
+    return enqueue(hold.user_id, 'hold_ready', f'"{book.title}" is ready for you',
+            f'A copy of "{book.title}" is being kept for you until {hold.expires_at:%Y-%m-%d}. '
+            f'Borrow it from My Books before then or it passes to the next patron.',
+            dedupe_key=f'hold_ready:{hold.id}')
+
+
+def notify_due_soon(record):
+    return enqueue(record.user_id, 'due_soon', f'"{record.book.title}" is due soon',
+            f'"{record.book.title}" is due back on {record.due_date:%Y-%m-%d}.',
+            dedupe_key=f'due_soon:{record.id}:{record.due_date:%Y-%m-%d}')
+
+
+def notify_overdue(record, now):
+    days = (now - record.due_date).days
+    # One reminder per record every REMINDER_OVERDUE_EVERY_DAYS
+    period = days // Config.REMINDER_OVERDUE_EVERY_DAYS
+    return enqueue(record.user_id, 'overdue', f'"{record.book.title}" is overdue',
+            f'"{record.book.title}" was due on {record.due_date:%Y-%m-%d} and is {days} day(s) overdue. '
+            f'A fine of ₹{Config.FINE_PER_DAY} per day applies until it is returned.',
+            dedupe_key=f'overdue:{record.id}:{period}')
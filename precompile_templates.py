@@ -0,0 +1,41 @@
+"""
+Compile every template into the Jinja bytecode cache, e.g. as a build step.
+
+Workers then load the compiled templates from JINJA_BYTECODE_CACHE_DIR
+instead of parsing and compiling each one on its first request. Entries are
+checked against the template source, so an edited template is simply
+compiled again on first use.
+
+    python precompile_templates.py
+"""
+
+import argparse
+import time
+
+from config import Config
+
+
+def precompile_templates(app):
+    """Load every template once so the bytecode cache holds all of them; returns their names"""
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fill the Jinja bytecode cache')
+    parser.add_argument('--clear', action='store_true', help='drop cached bytecode first')
+    args = parser.parse_args()
+
+    from app import app
+
+    if app.jinja_env.bytecode_cache is None:
+        raise SystemExit('JINJA_BYTECODE_CACHE_DIR is empty, so there is no bytecode cache to fill.')
+    if args.clear:
+        app.jinja_env.bytecode_cache.clear()
+
+    start = time.perf_counter()
+    names = precompile_templates(app)
+    print(f"Compiled {len(names)} templates into {Config.JINJA_BYTECODE_CACHE_DIR} "
+          f"in {time.perf_counter() - start:.2f}s.")
@@ -0,0 +1,200 @@
+"""
+Rebuild the "patrons who borrowed this also borrowed" table.
+
+Borrow history is streamed as distinct (user, book) pairs ordered by user.
+Each chunk of patrons is turned into a sparse book x book co-occurrence
+matrix in COO form (flattened row * n + col keys with counts) using NumPy,
+and the chunks are summed into one matrix. Only the top-K neighbours per
+book are written to book_recommendations, so serving is one indexed lookup.
+
+    python recommendations.py
+    python recommendations.py --top-k 10 --passes 4
+"""
+
+import argparse
+
+import numpy as np
+
+from config import Config
+from models import db, Book, BorrowRecord, ArchivedBorrowRecord, BookRecommendation
+
+INSERT_BATCH_SIZE = 5000
+
+
+def _stream_baskets(chunk_size):
+    """Yield (user_ids, book_ids) arrays, never splitting one patron across chunks"""
+    pairs = db.union(
+        db.select(BorrowRecord.user_id, BorrowRecord.book_id),
+        db.select(ArchivedBorrowRecord.user_id, ArchivedBorrowRecord.book_id)
+    ).subquery()
+    query = db.select(pairs.c.user_id, pairs.c.book_id).order_by(
+        pairs.c.user_id
+    ).execution_options(yield_per=chunk_size)
+
+    pending_users = np.empty(0, dtype=np.int64)
+    pending_books = np.empty(0, dtype=np.int64)
+
+    for rows in db.session.execute(query).partitions():
+        users = np.concatenate([pending_users, np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))])
+        books = np.concatenate([pending_books, np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))])
+
+        # The last patron may continue in the next chunk
+        cut = np.searchsorted(users, users[-1])
+        pending_users, pending_books = users[cut:], books[cut:]
+        if cut:
+            yield users[:cut], books[:cut]
+
+    if len(pending_users):
+        yield pending_users, pending_books
+
+
+def _co_occurrences(users, books, max_basket, max_pairs, low, high, n_books):
+    """Return (keys, counts) of book pairs borrowed by the same patron.
+
+    users must be sorted and books already mapped to dense indexes. Only pairs
+    whose left book index falls in [low, high) are kept. A basket of n books
+    expands to n * n pairs, so baskets are paired in groups of at most
+    max_pairs pairs to bound the arrays built at once.
+    """
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    sizes = np.diff(np.r_[starts, len(users)])
+
+    keep = (sizes > 1) & (sizes <= max_basket)
+    starts, sizes = starts[keep], sizes[keep]
+    keys = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+
+    pair_totals = np.cumsum(sizes * sizes)
+    group_start = 0
+    while group_start < len(starts):
+        done = pair_totals[group_start - 1] if group_start else 0
+        # Always take at least one basket; a single one is at most max_basket ** 2 pairs
+        group_end = max(int(np.searchsorted(pair_totals, done + max_pairs, side='right')), group_start + 1)
+        group_keys, group_counts = _basket_pairs(
+            books, starts[group_start:group_end], sizes[group_start:group_end], low, high, n_books
+        )
+        if len(group_keys):
+            keys, counts = _merge(keys, counts, group_keys, group_counts)
+        group_start = group_end
+
+    return keys, counts
+
+
+def _basket_pairs(books, starts, sizes, low, high, n_books):
+    """(keys, counts) of every pair of books within each of the given baskets"""
+    member = _basket_members(starts, sizes)
+    repeat = np.repeat(sizes, sizes)
+    first = np.repeat(starts, sizes)
+
+    left = np.repeat(books[member], repeat)
+    within = np.arange(repeat.sum()) - np.repeat(np.cumsum(repeat) - repeat, repeat)
+    right = books[np.repeat(first, repeat) + within]
+
+    mask = (left != right) & (left >= low) & (left < high)
+    keys = left[mask] * n_books + right[mask]
+    return np.unique(keys, return_counts=True)
+
+
+def _basket_members(starts, sizes):
+    """Indexes of every row belonging to the kept baskets, without a Python loop"""
+    offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return np.repeat(starts, sizes) + offsets
+
+
+def _merge(keys, counts, new_keys, new_counts):
+    """Sum two sparse COO count vectors"""
+    merged_keys, inverse = np.unique(np.concatenate([keys, new_keys]), return_inverse=True)
+    merged_counts = np.bincount(inverse, weights=np.concatenate([counts, new_counts]))
+    return merged_keys, merged_counts.astype(np.int64)
+
+
+def _top_k(keys, counts, n_books, top_k):
+    """Return (left, right, count, rank) arrays for the top_k neighbours of each book"""
+    left, right = keys // n_books, keys % n_books
+    order = np.lexsort((right, -counts, left))
+    left, right, counts = left[order], right[order], counts[order]
+
+    group_start = np.flatnonzero(np.r_[True, left[1:] != left[:-1]])
+    sizes = np.diff(np.r_[group_start, len(left)])
+    rank = np.arange(len(left)) - np.repeat(group_start, sizes)
+
+    keep = rank < top_k
+    return left[keep], right[keep], counts[keep], rank[keep]
+
+
+def build_recommendations(top_k=None, max_basket=None, chunk_size=None, passes=1, max_pairs=None):
+    """Rebuild book_recommendations from the whole borrow history.
+
+    With passes > 1 the books are split into that many ranges and the history
+    is read once per range, so the summed matrix held in memory shrinks
+    accordingly. Returns the number of rows written.
+    """
+    top_k = top_k or Config.RECOMMENDATIONS_TOP_K
+    max_basket = max_basket or Config.RECOMMENDATIONS_MAX_BASKET
+    chunk_size = chunk_size or Config.RECOMMENDATIONS_CHUNK_SIZE
+    max_pairs = max_pairs or Config.RECOMMENDATIONS_MAX_PAIRS
+
+    book_ids = np.array([book_id for (book_id,) in db.session.query(Book.id).order_by(Book.id)], dtype=np.int64)
+    n_books = len(book_ids)
+    results = []
+
+    bounds = np.linspace(0, n_books, passes + 1).astype(np.int64)
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        keys = np.empty(0, dtype=np.int64)
+        counts = np.empty(0, dtype=np.int64)
+
+        for users, books in _stream_baskets(chunk_size):
+            # Map book ids to dense matrix indexes, dropping deleted books
+            position = np.minimum(np.searchsorted(book_ids, books), max(n_books - 1, 0))
+            found = book_ids[position] == books if n_books else np.zeros(len(books), dtype=bool)
+            chunk_keys, chunk_counts = _co_occurrences(
+                users[found], position[found], max_basket, max_pairs, low, high, n_books
+            )
+            if len(chunk_keys):
+                keys, counts = _merge(keys, counts, chunk_keys, chunk_counts)
+
+        results.append(_top_k(keys, counts, n_books, top_k))
+
+    # End the read transaction, then swap the table in one short write so the
+    # database is only locked for the delete and inserts, never for the NumPy passes
+    db.session.commit()
+    BookRecommendation.query.delete(synchronize_session=False)
+    written = 0
+    for left, right, scores, ranks in results:
+        rows = [
+            {
+                'book_id': int(book_ids[book]),
+                'rank': int(rank),
+                'recommended_book_id': int(book_ids[neighbour]),
+                'score': int(score)
+            }
+            for book, neighbour, score, rank in zip(left, right, scores, ranks)
+        ]
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            db.session.execute(db.insert(BookRecommendation), rows[start:start + INSERT_BATCH_SIZE])
+        written += len(rows)
+
+    db.session.commit()
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the "also borrowed" recommendations')
+    parser.add_argument('--top-k', type=int, default=Config.RECOMMENDATIONS_TOP_K,
+                        help='neighbours stored per book')
+    parser.add_argument('--max-basket', type=int, default=Config.RECOMMENDATIONS_MAX_BASKET,
+                        help='ignore patrons who borrowed more distinct books than this')
+    parser.add_argument('--chunk-size', type=int, default=Config.RECOMMENDATIONS_CHUNK_SIZE,
+                        help='borrow events read per chunk')
+    parser.add_argument('--passes', type=int, default=1,
+                        help='split the books into this many ranges to lower peak memory')
+    parser.add_argument('--max-pairs', type=int, default=Config.RECOMMENDATIONS_MAX_PAIRS,
+                        help='book pairs expanded at once within a chunk')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        total = build_recommendations(args.top_k, args.max_basket, args.chunk_size, args.passes,
+                                      args.max_pairs)
+        print(f"Stored {total} recommendations.")
@@ -0,0 +1,120 @@
+"""
+Response compression, Cache-Control policies and versioned static files.
+
+    @app.route('/books')
+    @cache_policy('private, no-cache', etag=True)
+    def show_books(): ...
+
+Routes marked with etag=True get a weak ETag of their body, so a browser
+revalidating with If-None-Match receives an empty 304 instead of the page.
+Bodies above the size threshold are gzip-compressed, or brotli-compressed
+when the `brotli` package is installed and the client accepts it.
+
+Templates link static files through static_url(), which appends a hash of
+the file contents. Those URLs never change meaning, so they are served with
+a one-year immutable Cache-Control.
+"""
+
+import gzip
+import hashlib
+import os
+
+from flask import request, url_for
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+}
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+
+def cache_policy(value, etag=False):
+    """Set the Cache-Control header of a view, optionally with a weak ETag"""
+    def decorator(f):
+        f.cache_policy = (value, etag)
+        return f
+    return decorator
+
+
+def _is_compressible(response, min_size):
+    return not (
+        response.direct_passthrough
+        or response.status_code != 200
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or response.content_length is None
+        or response.content_length < min_size
+    )
+
+
+def _accepted_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress(body, encoding, level):
+    if encoding == 'br':
+        # Brotli quality runs 0-11 while the gzip level runs 1-9
+        return brotli.compress(body, quality=min(11, level + 2))
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+class ResponsePipeline:
+    """Registers the after_request hook and the static_url() template helper"""
+
+    def __init__(self, app, min_size, level):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self._static_versions = {}
+        app.jinja_env.globals['static_url'] = self.static_url
+        app.after_request(self.process_response)
+
+    def static_url(self, filename):
+        """URL of a static file carrying a hash of its contents"""
+        version = self._static_versions.get(filename)
+        if version is None or self.app.debug:
+            path = os.path.join(self.app.static_folder, filename)
+            with open(path, 'rb') as static_file:
+                version = hashlib.md5(static_file.read()).hexdigest()[:12]
+            self._static_versions[filename] = version
+        return url_for('static', filename=filename, v=version)
+
+    def process_response(self, response):
+        if response.mimetype in COMPRESSIBLE_MIMETYPES:
+            response.vary.add('Accept-Encoding')
+            if request.endpoint == 'static' and response.status_code == 200:
+                # Stylesheets are small, so read them into memory to compress them
+                response.direct_passthrough = False
+        compressible = _is_compressible(response, self.min_size)
+        encoding = _accepted_encoding() if compressible else None
+
+        view = self.app.view_functions.get(request.endpoint)
+        policy = getattr(view, 'cache_policy', None)
+
+        if request.endpoint == 'static' and 'v' in request.args:
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE
+        elif policy is not None and response.status_code == 200:
+            value, etag = policy
+            response.headers['Cache-Control'] = value
+            if etag and not response.direct_passthrough:
+                response.add_etag(weak=True)
+                if encoding:
+                    # Each encoding is a different representation with its own validator
+                    tag, weak = response.get_etag()
+                    response.set_etag(f'{tag}-{encoding}', weak=weak)
+                response.make_conditional(request)
+
+        if encoding and response.status_code == 200:
+            response.set_data(_compress(response.get_data(), encoding, self.level))
+            response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,162 @@
+"""
+Engine profile for running LibWise on a single SQLite file under gunicorn.
+
+  - WAL journal, so readers never wait for a writer and vice versa
+  - synchronous=NORMAL, which is durable in WAL mode up to the last checkpoint
+  - busy_timeout, so a writer waits for the lock instead of failing at once
+  - a larger page cache, memory-mapped reads and in-memory temp tables
+  - BEGIN IMMEDIATE for requests that will write, so they queue for the write
+    lock up front instead of failing with "database is locked" when a read
+    transaction has to be upgraded
+  - a background thread per worker running PRAGMA optimize and WAL checkpoints
+
+Requests with a POST/PUT/PATCH/DELETE method are treated as writers. Mark
+GET views that commit with @write_intent(), and POST views that do slow work
+(e.g. password hashing) before a tiny write with @write_intent(False) and
+do that write inside write_transaction().
+"""
+
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+
+from flask import request
+from sqlalchemy import event
+
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+_begin_immediate = contextvars.ContextVar('sqlite_begin_immediate', default=False)
+
+
+def write_intent(enabled=True):
+    """Decorator overriding whether a view's transactions start with BEGIN IMMEDIATE"""
+    def decorator(f):
+        f.write_intent = enabled
+        return f
+    return decorator
+
+
+@contextmanager
+def immediate_transactions():
+    """Start transactions with BEGIN IMMEDIATE inside this block, e.g. in a batch job"""
+    token = _begin_immediate.set(True)
+    try:
+        yield
+    finally:
+        _begin_immediate.reset(token)
+
+
+@contextmanager
+def write_transaction(session):
+    """End the session's read transaction, then start the block's one with BEGIN IMMEDIATE.
+
+    A read transaction cannot wait for the write lock when it tries to write,
+    it fails with "database is locked" instead, so a view that reads first
+    (as every request does) must not write in that same transaction.
+    """
+    session.commit()
+    with immediate_transactions():
+        yield
+
+
+def apply_sqlite_profile(engine, pragmas):
+    """Install the connect-time PRAGMAs and explicit BEGIN handling on a SQLite engine"""
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        # Let SQLAlchemy emit BEGIN itself (see below) instead of the driver
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.exec_driver_sql('BEGIN IMMEDIATE' if _begin_immediate.get() else 'BEGIN')
+
+
+class SqliteMaintenance:
+    """Runs PRAGMA optimize and a passive WAL checkpoint every interval seconds.
+
+    engines is called on every run and returns the engines to maintain, so
+    engines opened after the thread started (e.g. branch databases) are
+    included.
+    """
+
+    def __init__(self, engines, interval):
+        self.engines = engines
+        self.interval = interval
+        self._pid = None
+        self._stopped = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # Threads do not survive fork, so every gunicorn worker starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._stopped = threading.Event()
+                threading.Thread(target=self._run, args=(self._stopped,),
+                                 name='sqlite-maintenance', daemon=True).start()
+
+    def stop(self):
+        """Stop this process's thread, e.g. in a parent before it forks workers"""
+        with self._lock:
+            if self._stopped is not None:
+                self._stopped.set()
+            self._pid = self._stopped = None
+
+    def run_once(self):
+        for engine in self.engines():
+            # One failing database must not stop the others' maintenance
+            try:
+                with engine.connect() as connection:
+                    # A checkpoint cannot run inside a transaction, so bypass SQLAlchemy's BEGIN
+                    driver_connection = connection.connection.driver_connection
+                    driver_connection.execute('PRAGMA optimize')
+                    driver_connection.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+            except Exception as e:
+                print(f"SQLite maintenance failed on {engine.url.database}: {e}")
+
+    def _run(self, stopped):
+        while not stopped.wait(self.interval):
+            self.run_once()
+
+
+def init_sqlite_profile(app, engine, pragmas, maintenance_interval, extra_engines=None):
+    """Apply the profile to the app's engine and choose BEGIN IMMEDIATE per request.
+
+    engine may be None when only other databases are on SQLite. extra_engines,
+    if given, returns further engines that already have the profile (e.g. the
+    open branch engines), which get the same maintenance.
+    """
+    if engine is not None:
+        apply_sqlite_profile(engine, pragmas)
+
+    def maintained_engines():
+        engines = [engine] if engine is not None else []
+        if extra_engines is not None:
+            engines.extend(extra_engines())
+        return engines
+
+    maintenance = SqliteMaintenance(maintained_engines, maintenance_interval)
+
+    # Registered first so it runs before any other hook opens a transaction
+    @app.before_request
+    def mark_write_intent():
+        maintenance.ensure_started()
+        view = app.view_functions.get(request.endpoint)
+        intent = getattr(view, 'write_intent', request.method in WRITE_METHODS)
+        request.sqlite_intent_token = _begin_immediate.set(intent)
+
+    @app.teardown_request
+    def clear_write_intent(exc):
+        token = getattr(request, 'sqlite_intent_token', None)
+        if token is not None:
+            _begin_immediate.reset(token)
+
+    return maintenance
@@ -0,0 +1,254 @@
+"""
+Multi-branch mode: one LibWise app serving several library branches.
+
+Each branch keeps its own database, listed in the JSON file named by
+TENANTS_FILE (see tenants.example.json):
+
+    {"north": {"database_url": "sqlite:///branch_north.db", "hosts": ["north.localhost"]}}
+
+TenantRouter picks the branch of a request from its first path segment
+(/north/books) or from its Host header, and every query in that request runs
+on the branch's engine. Engines are created on first use with a small pool
+each. When a worker has more than TENANT_MAX_ENGINES branches open, the least
+recently used branch with no request in flight is disposed, which closes its
+connections; it is reopened on its next request.
+
+Maintenance scripts work on the branch named by the TENANT environment
+variable, e.g. TENANT=north python holds.py
+"""
+
+import json
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context, request, session
+from flask.sessions import SecureCookieSessionInterface
+from flask_sqlalchemy import SQLAlchemy
+from werkzeug.exceptions import NotFound
+
+ENVIRON_KEY = 'libwise.tenant'
+
+
+def load_tenants(path):
+    """Branches from a JSON file of {name: {"database_url": ..., "hosts": [...]}}"""
+    with open(path, encoding='utf-8') as tenants_file:
+        tenants = json.load(tenants_file)
+
+    for name, tenant in tenants.items():
+        if not name or '/' in name:
+            raise ValueError(f'Invalid branch name: {name!r}')
+        if not tenant.get('database_url'):
+            raise ValueError(f'Branch {name!r} has no database_url')
+    return tenants
+
+
+def current_tenant():
+    """Name of the branch being served, or None in single-library mode"""
+    if not has_app_context():
+        return None
+    tenancy = current_app.extensions.get('tenancy')
+    if tenancy is None:
+        return None
+    return g.get('tenant') or tenancy.cli_tenant
+
+
+class TenantSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy whose default engine is the current branch's in multi-branch mode"""
+
+    @property
+    def engines(self):
+        tenant = current_tenant()
+        if tenant is None:
+            return super().engines
+        return {None: current_app.extensions['tenancy'].registry.get(tenant)}
+
+    @property
+    def main_engine(self):
+        """The engine of SQLALCHEMY_DATABASE_URI, whichever branch is current"""
+        return super().engines[None]
+
+    def create_tenant_engine(self, app, url, **options):
+        """Engine for a branch database, with the same URL handling as the main engine"""
+        options['url'] = sa.engine.make_url(url)
+        # Relative SQLite paths go to the instance folder, like SQLALCHEMY_DATABASE_URI
+        self._apply_driver_defaults(options, app)
+        return self._make_engine(None, options, app)
+
+
+class EngineRegistry:
+    """Branch engines, created on first use and disposed least recently used first.
+
+    A request leases its branch's engine, and a leased engine is never
+    disposed, so a burst over max_engines only closes idle branches.
+    """
+
+    def __init__(self, factory, max_engines):
+        self.factory = factory
+        self.max_engines = max_engines
+        self._engines = OrderedDict()
+        self._leases = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            engine = self._engines.get(name)
+            if engine is None:
+                engine = self._engines[name] = self.factory(name)
+            else:
+                self._engines.move_to_end(name)
+            evicted = self._evict()
+        for old in evicted:
+            old.dispose()
+        return engine
+
+    def acquire(self, name):
+        """Lease the engine of a branch for the length of a request"""
+        with self._lock:
+            self._leases[name] += 1
+        try:
+            return self.get(name)
+        except Exception:
+            self.release(name)
+            raise
+
+    def release(self, name):
+        with self._lock:
+            self._leases[name] -= 1
+            if self._leases[name] <= 0:
+                del self._leases[name]
+            evicted = self._evict()
+        for old in evicted:
+            old.dispose()
+
+    def open_engines(self):
+        """The branch engines open right now, e.g. for maintenance"""
+        with self._lock:
+            return list(self._engines.values())
+
+    def dispose_all(self):
+        """Close every pooled connection, e.g. before the process forks"""
+        with self._lock:
+            engines = list(self._engines.values())
+        for engine in engines:
+            engine.dispose()
+
+    def _evict(self):
+        evicted = []
+        for name in list(self._engines):
+            if len(self._engines) <= self.max_engines:
+                break
+            if not self._leases[name]:
+                evicted.append(self._engines.pop(name))
+        return evicted
+
+
+class TenantRouter:
+    """WSGI middleware that picks the branch from the first path segment or the host name"""
+
+    def __init__(self, wsgi_app, tenants, routing='path'):
+        if routing not in ('path', 'host'):
+            raise ValueError(f'Unknown tenant routing: {routing}')
+        self.wsgi_app = wsgi_app
+        self.tenants = tenants
+        self.routing = routing
+        self.hosts = {
+            host.lower(): name
+            for name, tenant in tenants.items()
+            for host in tenant.get('hosts', [])
+        }
+
+    def __call__(self, environ, start_response):
+        # Internal requests (e.g. the warm-up) name their branch directly
+        tenant = environ.get(ENVIRON_KEY) or self._resolve(environ)
+        if tenant is None:
+            return NotFound('Unknown library branch.')(environ, start_response)
+        environ[ENVIRON_KEY] = tenant
+        return self.wsgi_app(environ, start_response)
+
+    def _resolve(self, environ):
+        if self.routing == 'host':
+            host = environ.get('HTTP_HOST') or environ.get('SERVER_NAME', '')
+            return self.hosts.get(host.rsplit(':', 1)[0].lower())
+
+        segment, _, rest = environ.get('PATH_INFO', '').lstrip('/').partition('/')
+        if segment not in self.tenants:
+            return None
+        # Move the prefix to SCRIPT_NAME so url_for() keeps generating /<branch>/... links
+        environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + '/' + segment
+        environ['PATH_INFO'] = '/' + rest
+        return segment
+
+
+class BranchSessionInterface(SecureCookieSessionInterface):
+    """Session cookie limited to the branch's path, so each branch has its own login"""
+
+    def get_cookie_path(self, app):
+        return request.script_root or super().get_cookie_path(app)
+
+
+class Tenancy:
+    """Serves several branches from one app, each on its own database.
+
+    Create it before db.init_app(app): its before_request hook must run
+    before any other hook queries the database, and its teardown must run
+    after Flask-SQLAlchemy has returned the request's connection.
+    """
+
+    def __init__(self, app, db, tenants, routing='path', max_engines=16, engine_options=None,
+                 configure_engine=None, cli_tenant=None):
+        if cli_tenant and cli_tenant not in tenants:
+            raise ValueError(f'Unknown branch in TENANT: {cli_tenant}')
+
+        self.app = app
+        self.db = db
+        self.tenants = tenants
+        self.engine_options = engine_options or {}
+        self.configure_engine = configure_engine
+        self.cli_tenant = cli_tenant
+        self.registry = EngineRegistry(self._create_engine, max_engines)
+
+        app.wsgi_app = TenantRouter(app.wsgi_app, tenants, routing)
+        if routing == 'path':
+            app.session_interface = BranchSessionInterface()
+        app.extensions['tenancy'] = self
+        app.before_request(self._start_request)
+        app.after_request(self._stamp_session)
+        app.teardown_appcontext(self._end_request)
+
+    def _create_engine(self, name):
+        engine = self.db.create_tenant_engine(self.app, self.tenants[name]['database_url'],
+                                              **self.engine_options)
+        if self.configure_engine is not None:
+            self.configure_engine(engine)
+        return engine
+
+    @contextmanager
+    def branch(self, name):
+        """App context working on one branch's database outside a request"""
+        with self.app.app_context():
+            g.tenant = name
+            yield
+
+    def _start_request(self):
+        tenant = request.environ.get(ENVIRON_KEY)
+        if tenant is None:
+            raise NotFound('Unknown library branch.')
+        self.registry.acquire(tenant)
+        g.tenant = g.tenant_lease = tenant
+
+        # User ids are only unique within a branch: never honour another branch's login
+        if 'user_id' in session and session.get('tenant') != tenant:
+            session.clear()
+
+    def _stamp_session(self, response):
+        tenant = g.get('tenant')
+        if tenant and 'user_id' in session and session.get('tenant') != tenant:
+            session['tenant'] = tenant
+        return response
+
+    def _end_request(self, exc):
+        tenant = g.pop('tenant_lease', None)
+        if tenant is not None:
+            self.registry.release(tenant)
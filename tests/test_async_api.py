@@ -0,0 +1,33 @@
+"""
+Session cookies on the asyncio API tier.
+
+    python -m pytest tests
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The app reads its configuration on import
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='libwise-test-'), 'test.db'))
+os.environ.pop('TENANTS_FILE', None)
+
+from async_api import app  # noqa: E402
+
+
+def test_session_is_written_back_to_the_cookie():
+    async def exchange():
+        client = app.test_client()
+        async with client.session_transaction() as api_session:
+            api_session.update(user_id=1, tenant='north')
+            api_session.permanent = True
+        # Branch sessions are refused before any query, and a permanent session is re-sent each time
+        return await client.get('/api/statistics')
+
+    response = asyncio.run(exchange())
+    assert response.status_code == 404
+    assert response.headers['Set-Cookie'].startswith('session=')
@@ -0,0 +1,147 @@
+"""
+Hold queue behaviour when patrons are deleted, borrow directly, or copies are added.
+
+Runs against a throwaway SQLite database:
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The app reads its configuration on import
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='libwise-test-'), 'test.db')
+os.environ.pop('TENANTS_FILE', None)
+
+from app import app  # noqa: E402
+from models import db, User, Book, BorrowRecord, Hold  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        admin = User(username='admin', full_name='System Administrator', is_admin=True)
+        admin.set_password('admin123')
+        db.session.add(admin)
+        db.session.commit()
+        admin_id = admin.id
+
+    client = app.test_client()
+    with client.session_transaction() as admin_session:
+        admin_session.update(user_id=admin_id, username='admin', is_admin=True)
+    yield client
+
+    with app.app_context():
+        db.session.remove()
+
+
+def _patron(username):
+    user = User(username=username, full_name=username.title(), password_hash='-')
+    db.session.add(user)
+    return user
+
+
+def _book_on_hold(*queue):
+    """A one-copy book set aside for the first patron in queue, the rest waiting behind"""
+    book = Book(title='Dune', author='Frank Herbert', isbn='9780441013593',
+                total_copies=1, available_copies=0)
+    db.session.add(book)
+    db.session.flush()
+
+    start = datetime.utcnow() - timedelta(days=1)
+    for position, user in enumerate(queue):
+        hold = Hold(user_id=user.id, book_id=book.id, status='waiting',
+                    created_at=start + timedelta(minutes=position))
+        if position == 0:
+            hold.status = 'ready'
+            hold.ready_at = start
+            hold.expires_at = start + timedelta(days=3)
+        db.session.add(hold)
+    db.session.commit()
+    return book.id
+
+
+def _bulk_delete(client, *user_ids):
+    response = client.post('/admin/users/bulk-delete', json={'user_ids': list(user_ids)})
+    assert response.status_code == 200
+    assert all(result['ok'] for result in response.get_json()['results'])
+
+
+def test_copy_skips_waiting_hold_deleted_in_same_batch(client):
+    with app.app_context():
+        ready, waiting, survivor = _patron('ready'), _patron('waiting'), _patron('survivor')
+        db.session.flush()
+        book_id = _book_on_hold(ready, waiting, survivor)
+        doomed = (ready.id, waiting.id)
+        survivor_id = survivor.id
+
+    _bulk_delete(client, *doomed)
+
+    with app.app_context():
+        holds = Hold.query.filter_by(book_id=book_id).all()
+        assert [(hold.user_id, hold.status) for hold in holds] == [(survivor_id, 'ready')]
+        assert db.session.get(Book, book_id).available_copies == 0
+
+
+def test_copy_returns_to_shelf_when_whole_queue_is_deleted(client):
+    with app.app_context():
+        ready, waiting = _patron('ready'), _patron('waiting')
+        db.session.flush()
+        book_id = _book_on_hold(ready, waiting)
+        doomed = (ready.id, waiting.id)
+
+    _bulk_delete(client, *doomed)
+
+    with app.app_context():
+        assert Hold.query.filter_by(book_id=book_id).count() == 0
+        assert db.session.get(Book, book_id).available_copies == 1
+
+
+def test_direct_borrow_fulfils_own_waiting_hold(client):
+    with app.app_context():
+        patron = _patron('patron')
+        book = Book(title='Emma', author='Jane Austen', isbn='9780141439587',
+                    total_copies=1, available_copies=1)
+        db.session.add(book)
+        db.session.flush()
+        db.session.add(Hold(user_id=patron.id, book_id=book.id, status='waiting'))
+        db.session.commit()
+        patron_id, book_id = patron.id, book.id
+
+    with client.session_transaction() as patron_session:
+        patron_session.update(user_id=patron_id, username='patron', is_admin=False)
+    client.post(f'/borrow/{book_id}')
+
+    with app.app_context():
+        assert BorrowRecord.query.filter_by(user_id=patron_id, book_id=book_id).count() == 1
+        assert Hold.query.filter_by(book_id=book_id).one().status == 'fulfilled'
+        assert db.session.get(Book, book_id).available_copies == 0
+
+
+def test_added_copies_go_to_waiting_holds_first(client):
+    with app.app_context():
+        ready, first, second = _patron('ready'), _patron('first'), _patron('second')
+        db.session.flush()
+        book_id = _book_on_hold(ready, first, second)
+        first_id, second_id = first.id, second.id
+
+    response = client.post(f'/admin/books/edit/{book_id}', data={
+        'title': 'Dune', 'author': 'Frank Herbert', 'isbn': '9780441013593',
+        'total_copies': 4,
+    })
+    assert response.status_code == 302
+
+    with app.app_context():
+        statuses = {hold.user_id: hold.status for hold in Hold.query.filter_by(book_id=book_id)}
+        assert statuses[first_id] == statuses[second_id] == 'ready'
+        book = db.session.get(Book, book_id)
+        assert (book.total_copies, book.available_copies) == (4, 1)
@@ -0,0 +1,165 @@
+"""
+Bring an existing database up to date with models.py.
+
+db.create_all() only creates missing tables and never changes existing ones.
+This script also adds what it cannot:
+  - new columns (they must be nullable)
+  - ON DELETE CASCADE rules on foreign keys (SQLite tables are rebuilt)
+  - missing indexes
+It is safe to run more than once.
+
+    python upgrade_db.py
+"""
+
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import AddConstraint
+
+from models import db
+
+# SQL giving the value of a new column for existing rows; :now is the upgrade time (UTC)
+BACKFILLS = {
+    # Rows archived before original_id existed kept their borrow_records id as id
+    ('borrow_records_archive', 'original_id'): 'id',
+    # Row version stamps; a NULL one would leave the availability index without a watermark
+    ('books', 'updated_at'): 'COALESCE(created_at, :now)',
+    ('borrow_records', 'updated_at'): 'COALESCE(return_date, borrow_date, :now)',
+}
+
+
+def _quote(connection, name):
+    return connection.dialect.identifier_preparer.quote(name)
+
+
+def _add_missing_columns(connection, table):
+    """Add model columns the database table does not have yet; returns their names"""
+    existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        column_type = column.type.compile(dialect=connection.dialect)
+        connection.execute(text(
+            f'ALTER TABLE {_quote(connection, table.name)} '
+            f'ADD COLUMN {_quote(connection, column.name)} {column_type}'
+        ))
+        source = BACKFILLS.get((table.name, column.name))
+        if source is not None:
+            connection.execute(text(
+                f'UPDATE {_quote(connection, table.name)} '
+                f'SET {_quote(connection, column.name)} = {source}'
+            ), {'now': datetime.utcnow()})
+        added.append(column.name)
+    return added
+
+
+def _missing_cascades(connection, table):
+    """Return (model constraint, database foreign key) pairs lacking ON DELETE CASCADE"""
+    existing = {
+        tuple(foreign_key['constrained_columns']): foreign_key
+        for foreign_key in inspect(connection).get_foreign_keys(table.name)
+    }
+
+    missing = []
+    for constraint in table.foreign_key_constraints:
+        if (constraint.ondelete or '').upper() != 'CASCADE':
+            continue
+        foreign_key = existing.get(tuple(column.name for column in constraint.columns))
+        ondelete = (foreign_key or {}).get('options', {}).get('ondelete') or ''
+        if ondelete.upper() != 'CASCADE':
+            missing.append((constraint, foreign_key))
+    return missing
+
+
+def _rebuild_sqlite_table(connection, table):
+    """SQLite cannot alter constraints, so copy the rows into a freshly created table"""
+    old_name = f'{table.name}_old'
+    columns = [
+        column['name'] for column in inspect(connection).get_columns(table.name)
+        if column['name'] in table.c
+    ]
+
+    connection.execute(text(f'ALTER TABLE {_quote(connection, table.name)} RENAME TO {_quote(connection, old_name)}'))
+    for index in inspect(connection).get_indexes(old_name):
+        connection.execute(text(f'DROP INDEX {_quote(connection, index["name"])}'))
+
+    table.create(connection)
+    column_list = ', '.join(_quote(connection, name) for name in columns)
+    connection.execute(text(
+        f'INSERT INTO {_quote(connection, table.name)} ({column_list}) '
+        f'SELECT {column_list} FROM {_quote(connection, old_name)}'
+    ))
+    connection.execute(text(f'DROP TABLE {_quote(connection, old_name)}'))
+
+
+def _add_cascades(connection, table, missing):
+    """Replace foreign keys in place on databases that support ALTER TABLE constraints"""
+    for constraint, foreign_key in missing:
+        if foreign_key and foreign_key.get('name'):
+            connection.execute(text(
+                f'ALTER TABLE {_quote(connection, table.name)} '
+                f'DROP CONSTRAINT {_quote(connection, foreign_key["name"])}'
+            ))
+        connection.execute(AddConstraint(constraint))
+
+
+def _set_foreign_keys(connection, enabled):
+    """Switch SQLite foreign key enforcement; only takes effect outside a transaction"""
+    connection.connection.driver_connection.execute(f'PRAGMA foreign_keys={"ON" if enabled else "OFF"}')
+
+
+def upgrade_database(engine):
+    """Create missing tables, columns, cascades and indexes. Returns a list of changes made."""
+    db.metadata.create_all(engine)
+    changes = []
+    is_sqlite = engine.dialect.name == 'sqlite'
+
+    with engine.connect() as connection:
+        if is_sqlite:
+            # Rows are copied between tables, so the constraints must not fire meanwhile.
+            # SQLite ignores this PRAGMA inside a transaction, so it goes straight to the
+            # driver connection before SQLAlchemy begins one
+            _set_foreign_keys(connection, False)
+
+        try:
+            for table in db.metadata.sorted_tables:
+                for column in _add_missing_columns(connection, table):
+                    changes.append(f'{table.name}: added column {column}')
+
+            for table in db.metadata.sorted_tables:
+                missing = _missing_cascades(connection, table)
+                if not missing:
+                    continue
+                if is_sqlite:
+                    _rebuild_sqlite_table(connection, table)
+                else:
+                    _add_cascades(connection, table, missing)
+                changes.append(f'{table.name}: added ON DELETE CASCADE')
+
+            for table in db.metadata.sorted_tables:
+                existing = {index['name'] for index in inspect(connection).get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in existing:
+                        index.create(connection)
+                        changes.append(f'{table.name}: created index {index.name}')
+
+            connection.commit()
+        finally:
+            if is_sqlite:
+                # Pooled connections must not keep enforcement off, even after an error
+                connection.rollback()
+                _set_foreign_keys(connection, True)
+
+    return changes
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        changes = upgrade_database(db.engine)
+
+    for change in changes:
+        print(change)
+    print(f"Database is up to date ({len(changes)} changes).")